@@ -0,0 +1,104 @@
+"""Speed of the copy text escaping of string values, compared with the
+chain of ``str.replace`` it replaced, over several text distributions.
+
+    python -m benchmarks.escaping --values 100000
+"""
+from __future__ import absolute_import
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from mysql2pgsql.lib.postgres_writer import _escape, escape_column
+
+WORDS = ('lorem', 'ipsum', 'dolor', u'sit\xe9', 'amet', 'consectetur', 'adipiscing', 'elit')
+SPECIALS = ('\t', '\n', '\\', '\r', '\r\n')
+
+
+def _text(rnd, words, dirty):
+    text = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(1, words)))
+    if rnd.random() < dirty:
+        position = rnd.randint(0, len(text))
+        text = text[:position] + rnd.choice(SPECIALS) + text[position:]
+    return text
+
+
+# name: value generator taking a random.Random
+DISTRIBUTIONS = {
+    # names, codes, short labels: nothing to escape
+    'short_clean': lambda r: _text(r, 4, 0),
+    # free text typed by users, a few with line breaks or tabs
+    'short_mixed': lambda r: _text(r, 12, 0.1),
+    # descriptions and comments, mostly multi-line
+    'long_mixed': lambda r: _text(r, 200, 0.6),
+    # the same short values read as UTF-8 bytes, see the mysql use_unicode option
+    'bytes_clean': lambda r: _text(r, 4, 0).encode('utf8'),
+    'bytes_mixed': lambda r: _text(r, 12, 0.1).encode('utf8'),
+}
+
+
+def chained_escape(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace(
+        '\t', r'\t').replace('\r', r'\r').replace('\0', '')
+
+
+def run_chained(values, batch):
+    return [chained_escape(v) for v in values]
+
+
+def run_escape(values, batch):
+    return [_escape(v) for v in values]
+
+
+def run_escape_column(values, batch):
+    escaped = []
+    for i in xrange(0, len(values), batch):
+        escaped.extend(escape_column(values[i:i + batch]))
+    return escaped
+
+
+PATHS = [
+    ('chained', run_chained),
+    ('escape', run_escape),
+    ('escape_column', run_escape_column),
+]
+
+
+def run_case(path, values, batch, repeat=3):
+    """Returns the best `values/sec` of `repeat` runs"""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        path(values, batch)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(values) / best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measures the speed of the copy text escaping.')
+    parser.add_argument('--values', type=int, default=100000, help='values per case (default: %(default)s)')
+    parser.add_argument('--batch', type=int, default=1000, help='values per escape_column call (default: %(default)s)')
+    parser.add_argument('--distributions', nargs='+', choices=sorted(DISTRIBUTIONS), default=sorted(DISTRIBUTIONS),
+                        help='text distributions to run (default: all)')
+    options = parser.parse_args(argv)
+
+    print('%-14s %-14s %14s %9s' % ('distribution', 'path', 'values/sec', 'speedup'))
+    for name in options.distributions:
+        rnd = random.Random(0)
+        values = [DISTRIBUTIONS[name](rnd) for _ in xrange(options.values)]
+        expected = run_chained(values, options.batch)
+        baseline = None
+        for path_name, path in PATHS:
+            assert path(values, options.batch) == expected, path_name
+            values_sec = run_case(path, values, options.batch)
+            baseline = baseline or values_sec
+            print('%-14s %-14s %14.0f %8.2fx' % (name, path_name, values_sec, values_sec / baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""Throughput of the conversion hot path, without any server.
+
+Synthetic rows are fed through :py:meth:`PostgresWriter.process_row` and
+the `write_contents` of both writers, which write to an in-memory sink.
+Each case runs in its own process so the reported peak RSS is its own.
+
+    python -m benchmarks.throughput --rows 200000 --types int varchar
+
+`--latency` simulates a network round trip per block of rows fetched
+from MySQL and per buffer sent to PostgreSQL, which the `db_writer_pipeline`
+path overlaps with the conversion.
+"""
+from __future__ import absolute_import
+
+import argparse
+import os
+import random
+import resource
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import cycle, islice
+from multiprocessing import Process, Queue
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from mysql2pgsql.lib.mysql_reader import MysqlReader
+from mysql2pgsql.lib.postgres_db_writer import PostgresDbWriter
+from mysql2pgsql.lib.postgres_file_writer import PostgresFileWriter
+from mysql2pgsql.lib.postgres_writer import PostgresWriter
+
+
+def column(name, column_type, **kwargs):
+    desc = {
+        'name': name,
+        'table_name': None,
+        'type': column_type,
+        'length': None,
+        'decimals': None,
+        'null': True,
+        'primary_key': False,
+        'auto_increment': False,
+        'default': None,
+        'comment': '',
+        'select': '`%s`' % name,
+        }
+    desc.update(kwargs)
+    return desc
+
+
+def _words(rnd, escapes):
+    text = ' '.join(rnd.choice(('lorem', 'ipsum', 'dolor', u'sit\xe9', 'amet')) for _ in range(rnd.randint(1, 8)))
+    if escapes and rnd.random() < 0.3:
+        text += rnd.choice(('\t', '\n', '\\', '\r'))
+    return text
+
+
+# name: (column definitions, value generator taking a random.Random)
+COLUMN_MIXES = {
+    'int': ([column('i', 'integer'), column('b', 'bigint'), column('s', 'tinyint')],
+            lambda r: (r.randint(0, 2 ** 31 - 1), r.randint(0, 2 ** 62), r.randint(0, 2 ** 15 - 1))),
+    'varchar': ([column('v', 'varchar', length=255), column('t', 'text')],
+                lambda r: (_words(r, False), _words(r, True))),
+    'blob': ([column('b', 'blob')],
+             lambda r: (''.join(chr(r.randint(0, 255)) for _ in range(r.randint(0, 64))), )),
+    'datetime': ([column('d', 'datetime'), column('ts', 'timestamp', default='CURRENT_TIMESTAMP'), column('tm', 'time')],
+                 lambda r: (datetime(2000, 1, 1) + timedelta(seconds=r.randint(0, 10 ** 9)),
+                            None if r.random() < 0.1 else datetime(2010, 1, 1) + timedelta(seconds=r.randint(0, 10 ** 8)),
+                            timedelta(seconds=r.randint(0, 86399)))),
+    'enum': ([column('e', "enum('small','medium','large')")],
+             lambda r: (r.choice((u'small', u'medium', u'large', None)), )),
+    'set': ([column('st', "set('a','b','c','d')")],
+            lambda r: (','.join(r.sample('abcd', r.randint(1, 4))), )),
+    'bit': ([column('bt', 'bit(8)'), column('bl', 'boolean')],
+            lambda r: (chr(r.randint(0, 255)), r.randint(0, 1))),
+}
+
+
+def fake_table(mix):
+    """A :py:class:`MysqlReader.Table` whose definition is preset, so
+    it never needs a server.
+    """
+    columns, _ = COLUMN_MIXES[mix]
+    table = MysqlReader.Table(None, 'bench_%s' % mix)
+    table._columns = [dict(c, table_name=table.name) for c in columns]
+    table._status = {'rows': 0, 'comment': '', 'auto_increment': None}
+    table._indexes, table._foreign_keys, table._triggers = [], [], []
+    return table
+
+
+class FakeReader(object):
+    """Stands in for :py:class:`MysqlReader`, reading `rows` rows cycling
+    over `distinct` generated ones, so that generating them isn't timed.
+    """
+    def __init__(self, mix, rows, distinct=1000, seed=0):
+        rnd = random.Random(seed)
+        generate = COLUMN_MIXES[mix][1]
+        self.samples = [generate(rnd) for _ in xrange(min(rows, distinct))]
+        self.rows = rows
+
+    def read(self, table, key_range=None):
+        rows = islice(cycle(self.samples), self.rows)
+        if not LATENCY:
+            return rows
+        return self._delayed(rows)
+
+    def _delayed(self, rows):
+        # a round trip to the server per block of rows fetched
+        for i, row in enumerate(rows):
+            if not i % FETCH_SIZE:
+                time.sleep(LATENCY)
+            yield row
+
+
+class Sink(object):
+    """In-memory file that only counts what is written to it"""
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+
+    def close(self):
+        pass
+
+
+class SinkDbWriter(PostgresDbWriter):
+    """:py:class:`PostgresDbWriter` draining its copy stream into a :py:class:`Sink`"""
+    def __init__(self, copy_format='text', batch_size=0, pipeline=False):
+        self.sink = Sink()
+        super(SinkDbWriter, self).__init__({'hostname': '', 'database': '', 'username': '', 'copy_format': copy_format},
+                                           index_prefix='', batch_size=batch_size, pipeline=pipeline)
+
+    def open(self):
+        pass
+
+    def copy_from(self, file_obj, table_name, columns, before_commit=None):
+        for block in iter(lambda: file_obj.read(self.copy_buffer_size), ''):
+            if LATENCY:
+                # a round trip to the server per buffer sent
+                time.sleep(LATENCY)
+            self.sink.write(block)
+
+    copy_binary = copy_from
+
+
+# rows per batch of the *_batch paths, see the batch_size option
+BATCH_SIZE = 5000
+
+# seconds slept per round trip to either server, see --latency
+LATENCY = 0
+
+# rows fetched from mysql per round trip, see the fetch_size option
+FETCH_SIZE = 1000
+
+
+def run_process_row(table, reader):
+    process_row = PostgresWriter(index_prefix='').process_row
+    size = 0
+    for row in reader.read(table):
+        row = list(row)
+        process_row(table, row)
+        size += sum(len(v) for v in row)
+    return size
+
+
+def run_file_writer(table, reader):
+    sink = Sink()
+    PostgresFileWriter(sink, index_prefix='').write_contents(table, reader)
+    return sink.bytes
+
+
+def run_db_writer(table, reader):
+    writer = SinkDbWriter()
+    writer.write_contents(table, reader)
+    return writer.sink.bytes
+
+
+def run_file_writer_batch(table, reader):
+    sink = Sink()
+    PostgresFileWriter(sink, index_prefix='', batch_size=BATCH_SIZE).write_contents(table, reader)
+    return sink.bytes
+
+
+def run_db_writer_batch(table, reader):
+    writer = SinkDbWriter(batch_size=BATCH_SIZE)
+    writer.write_contents(table, reader)
+    return writer.sink.bytes
+
+
+def run_db_writer_pipeline(table, reader):
+    writer = SinkDbWriter(pipeline=True)
+    writer.write_contents(table, reader)
+    return writer.sink.bytes
+
+
+def run_db_writer_binary(table, reader):
+    writer = SinkDbWriter('binary')
+    writer.write_contents(table, reader)
+    return writer.sink.bytes
+
+
+PATHS = {
+    'process_row': run_process_row,
+    'file_writer': run_file_writer,
+    'db_writer': run_db_writer,
+    'file_writer_batch': run_file_writer_batch,
+    'db_writer_batch': run_db_writer_batch,
+    'db_writer_pipeline': run_db_writer_pipeline,
+    'db_writer_binary': run_db_writer_binary,
+}
+
+
+def _run_case(path, mix, rows, results):
+    try:
+        table = fake_table(mix)
+        reader = FakeReader(mix, rows)
+        start = time.time()
+        size = PATHS[path](table, reader)
+        elapsed = time.time() - start
+        results.put((elapsed, size, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+    except Exception as e:
+        results.put(e)
+        raise
+
+
+def run_case(path, mix, rows):
+    """Runs one benchmark case in a fresh process.
+
+    Returns `(rows/sec, MB/sec, peak RSS in KB)`
+    """
+    results = Queue()
+    process = Process(target=_run_case, args=(path, mix, rows, results))
+    process.start()
+    result = results.get()
+    process.join()
+    if isinstance(result, Exception):
+        raise result
+    elapsed, size, rss = result
+    return rows / elapsed, size / elapsed / (1024 * 1024), rss
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measures the throughput of the row conversion pipeline.')
+    parser.add_argument('--rows', type=int, default=100000, help='rows per case (default: %(default)s)')
+    parser.add_argument('--types', nargs='+', choices=sorted(COLUMN_MIXES), default=sorted(COLUMN_MIXES),
+                        help='column mixes to run (default: all)')
+    parser.add_argument('--paths', nargs='+', choices=sorted(PATHS), default=sorted(PATHS),
+                        help='code paths to run (default: all)')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='milliseconds of network latency simulated per round trip to either server (default: %(default)s)')
+    options = parser.parse_args(argv)
+    global LATENCY
+    LATENCY = options.latency / 1000.0
+
+    print('%-10s %-18s %14s %10s %12s' % ('type', 'path', 'rows/sec', 'MB/sec', 'peak RSS KB'))
+    for mix in options.types:
+        for path in options.paths:
+            rows_sec, mb_sec, rss = run_case(path, mix, options.rows)
+            print('%-10s %-18s %14.0f %10.2f %12d' % (mix, path, rows_sec, mb_sec, rss))
+
+
+if __name__ == '__main__':
+    main()
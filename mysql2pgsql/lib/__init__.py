@@ -43,6 +43,13 @@ def print_red(val):
         print(val)
 
 
+def _within(context, f):
+    def call():
+        with context:
+            return f()
+    return call
+
+
 def status_logger(f):
     start_template = 'START  - %s'
     finish_template = 'FINISH - %s'
@@ -52,6 +59,8 @@ def status_logger(f):
     write_contents_template = 'WRITING DATA TO %s'
     index_template = 'ADDING INDEXES TO %s'
     trigger_template = 'ADDING TRIGGERS TO %s'
+    sync_contents_template = 'SYNCING DATA TO %s'
+    logged_template = 'SWITCHING TABLE %s TO LOGGED'
     statuses = {
         'truncate': {
             'start': start_template % truncate_template,
@@ -77,19 +86,50 @@ def status_logger(f):
             'start': start_template % trigger_template,
             'finish': finish_template % trigger_template,
             },
+        'sync_contents': {
+            'start': start_template % sync_contents_template,
+            'finish': finish_template % sync_contents_template,
+            },
+        'set_logged': {
+            'start': start_template % logged_template,
+            'finish': finish_template % logged_template,
+            },
+    }
+
+    # phase of the conversion each method is measured in, see mysql2pgsql.lib.metrics
+    phases = {
+        'truncate': 'ddl',
+        'write_table': 'ddl',
+        'write_constraints': 'constraints',
+        'write_contents': 'data',
+        'write_indexes': 'indexes',
+        'write_triggers': 'triggers',
+        'sync_contents': 'data',
+        'set_logged': 'logged',
     }
 
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if getattr(args[0], 'verbose', False):
+        verbose = getattr(args[0], 'verbose', False)
+        metrics = getattr(args[0], 'metrics', None)
+        profiler = getattr(args[0], 'profiler', None) if phases[f.func_name] == 'data' else None
+        if verbose or metrics or profiler:
             if 'table' in kwargs:
                 table = kwargs['table']
             else:
                 table = find_first(list(args) + kwargs.values(), lambda c: c.__class__ is MysqlReader.Table)
             assert table
-            print_table_actions(statuses[f.func_name]['start'] % table.name)
-            ret = f(*args, **kwargs)
-            print_table_actions(statuses[f.func_name]['finish'] % table.name)
+            if verbose:
+                print_table_actions(statuses[f.func_name]['start'] % table.name)
+            call = lambda: f(*args, **kwargs)
+            if profiler:
+                key_range = kwargs.get('key_range', args[3] if f.func_name == 'write_contents' and len(args) > 3 else None)
+                call = _within(profiler.profile_data(table.name, key_range), call)
+            if metrics:
+                call = _within(metrics.phase(table.name, phases[f.func_name]), call)
+            ret = call()
+            if verbose:
+                print_table_actions(statuses[f.func_name]['finish'] % table.name)
             return ret
         else:
             return f(*args, **kwargs)
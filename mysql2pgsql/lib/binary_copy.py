@@ -0,0 +1,207 @@
+from __future__ import absolute_import
+
+from datetime import datetime
+from decimal import Decimal
+from itertools import izip
+from struct import Struct
+
+from pytz import utc
+
+HEADER = 'PGCOPY\n\xff\r\n\x00' + Struct('!ii').pack(0, 0)
+TRAILER = Struct('!h').pack(-1)
+
+NULL = Struct('!i').pack(-1)
+TEXT_OID = 25
+PG_EPOCH = datetime(2000, 1, 1)
+PG_EPOCH_DATE = PG_EPOCH.date()
+NULL_TIMESTAMP = datetime(1970, 1, 1)
+
+_field_count = Struct('!h').pack
+_length = Struct('!i').pack
+_int2 = Struct('!ih').pack
+_int4 = Struct('!ii').pack
+_int8 = Struct('!iq').pack
+_float4 = Struct('!if').pack
+_float8 = Struct('!id').pack
+_timetz = Struct('!iqi').pack
+_array_header = Struct('!iiiii').pack
+_bool = {True: _length(1) + '\x01', False: _length(1) + '\x00'}
+
+
+def _microseconds(delta):
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _bytes(value):
+    return value.encode('utf8') if isinstance(value, unicode) else value
+
+
+def pack_text(value):
+    value = _bytes(value).replace('\0', '')
+    return _length(len(value)) + value
+
+
+def pack_bytea(value):
+    value = _bytes(value)
+    return _length(len(value)) + value
+
+
+def pack_smallint(value):
+    return _int2(2, value)
+
+
+def pack_integer(value):
+    return _int4(4, value)
+
+
+def pack_bigint(value):
+    return _int8(8, value)
+
+
+def pack_real(value):
+    return _float4(4, value)
+
+
+def pack_double(value):
+    return _float8(8, value)
+
+
+def pack_boolean(value):
+    if isinstance(value, basestring):
+        value = any(c != '\0' for c in value)
+    return _bool[value != 0]
+
+
+def pack_numeric(value):
+    """Packs `value` in the base 10000 digits of the numeric wire format"""
+    sign, digits, exponent = Decimal(value).as_tuple()
+    digits = ''.join(str(d) for d in digits)
+    if exponent > 0:
+        digits += '0' * exponent
+        exponent = 0
+    scale = -exponent
+    digits = digits.rjust(scale, '0')
+    whole, fraction = digits[:len(digits) - scale].lstrip('0'), digits[len(digits) - scale:]
+    whole = '0' * (-len(whole) % 4) + whole
+    fraction += '0' * (-len(fraction) % 4)
+    groups = [int(whole[i:i + 4]) for i in range(0, len(whole), 4)] + \
+        [int(fraction[i:i + 4]) for i in range(0, len(fraction), 4)]
+    weight = len(whole) // 4 - 1
+    while groups and groups[0] == 0:
+        groups.pop(0)
+        weight -= 1
+    while groups and groups[-1] == 0:
+        groups.pop()
+    if not groups:
+        weight, sign = 0, 0
+    data = Struct('!hhhh%dh' % len(groups)).pack(len(groups), weight, 0x4000 if sign else 0, scale, *groups)
+    return _length(len(data)) + data
+
+
+def pack_date(value):
+    if isinstance(value, datetime):
+        value = value.date()
+    return _int4(4, (value - PG_EPOCH_DATE).days)
+
+
+def pack_timestamp(value):
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return _int8(8, _microseconds(value - PG_EPOCH))
+
+
+def pack_timestamptz(value):
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    elif value.tzinfo:
+        value = value.astimezone(utc).replace(tzinfo=None)
+    return _int8(8, _microseconds(value - PG_EPOCH))
+
+
+def pack_time(value):
+    return _int8(8, _microseconds(value) % 86400000000)
+
+
+def pack_timetz(value):
+    return _timetz(12, _microseconds(value) % 86400000000, 0)
+
+
+def pack_varbit(value):
+    if isinstance(value, basestring):
+        value = int(_bytes(value).encode('hex') or '0', 16)
+    bits = bin(value)[2:]
+    padded = bits + '0' * (-len(bits) % 8)
+    data = _length(len(bits)) + ('%0*x' % (len(padded) // 4, int(padded, 2))).decode('hex')
+    return _length(len(data)) + data
+
+
+def pack_text_array(value):
+    elements = [_bytes(v).replace('\0', '') for v in value.split(',')]
+    data = _array_header(1, 0, TEXT_OID, len(elements), 1) + ''.join(_length(len(e)) + e for e in elements)
+    return _length(len(data)) + data
+
+
+def _packer_for(type_info):
+    """Picks the packer matching the PostgreSQL type declared by
+    :py:meth:`mysql2pgsql.lib.postgres_writer.PostgresWriter.column_type_info`
+    """
+    if type_info.startswith('smallint'):
+        return pack_smallint
+    elif type_info.startswith('integer'):
+        return pack_integer
+    elif type_info.startswith('bigint'):
+        return pack_bigint
+    elif type_info.startswith('boolean'):
+        return pack_boolean
+    elif type_info.startswith('real'):
+        return pack_real
+    elif type_info.startswith('double precision'):
+        return pack_double
+    elif type_info.startswith('numeric'):
+        return pack_numeric
+    elif type_info.startswith('timestamp with time zone'):
+        return pack_timestamptz
+    elif type_info.startswith('timestamp'):
+        return pack_timestamp
+    elif type_info.startswith('date'):
+        return pack_date
+    elif type_info.startswith('time with time zone'):
+        return pack_timetz
+    elif type_info.startswith('time'):
+        return pack_time
+    elif type_info.startswith('bytea'):
+        return pack_bytea
+    elif type_info.startswith('varbit'):
+        return pack_varbit
+    elif type_info.startswith('text[]'):
+        return pack_text_array
+    return pack_text
+
+
+def column_packer(writer, column):
+    """Returns a callable packing a single MySQL value of `column`
+    as a binary copy field, length prefix included.
+    """
+    type_info = writer.column_type_info(column)
+    pack = _packer_for(type_info)
+    if type_info.startswith('timestamp') and column['default']:
+        null = pack(NULL_TIMESTAMP)
+    else:
+        null = NULL
+
+    def packer(value):
+        return null if value is None else pack(value)
+    return packer
+
+
+def row_encoder(writer, table):
+    """Returns a callable that turns a row read from MySQL into
+    a binary copy tuple. The stream must start with :py:data:`HEADER`
+    and end with :py:data:`TRAILER`.
+    """
+    packers = [column_packer(writer, c) for c in table.columns]
+    field_count = _field_count(len(packers))
+
+    def encode(row):
+        return field_count + ''.join([pack(value) for pack, value in izip(packers, row)])
+    return encode
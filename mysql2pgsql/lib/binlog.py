@@ -0,0 +1,187 @@
+from __future__ import with_statement, absolute_import
+
+import json
+from collections import OrderedDict
+from contextlib import closing
+
+from . import print_red, print_table_actions
+
+try:
+    from pymysqlreplication import BinLogStreamReader
+    from pymysqlreplication.event import QueryEvent, XidEvent
+    from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+except ImportError:
+    BinLogStreamReader = None
+
+
+def open_stream(mysql_options, position, server_id):
+    """Opens a non blocking binlog stream of the row changes made to the
+    `mysql_options` database from `position` on, see :py:func:`transactions`.
+    Needs the `mysql-replication` package.
+    """
+    settings = {
+        'user': str(mysql_options.get('username', 'root')),
+        'passwd': str(mysql_options.get('password', None) or ''),
+        }
+    if mysql_options.get('socket', None):
+        settings['unix_socket'] = str(mysql_options['socket'])
+    else:
+        settings['host'] = str(mysql_options.get('hostname', 'localhost'))
+        settings['port'] = mysql_options.get('port', 3306)
+    log_file, log_pos = position
+    return BinLogStreamReader(connection_settings=settings,
+                              server_id=server_id,
+                              log_file=log_file,
+                              log_pos=log_pos,
+                              resume_stream=True,
+                              blocking=False,
+                              only_schemas=[mysql_options['database']],
+                              only_events=[WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent, XidEvent, QueryEvent])
+
+
+def transactions(stream):
+    """Groups the row events of a binlog `stream` by transaction.
+
+    Yields a `(position, changes)` tuple per committed transaction, where
+    `position` is the `(log_file, log_pos)` binlog position right after its
+    commit and `changes` the list of its `(table_name, before, after)` row
+    changes: `before` is None for inserts, `after` for deletes, otherwise
+    they hold the column values of the row by name. Transactions end on
+    their XID, or on a ``COMMIT`` query for the changes of non
+    transactional (e.g. MyISAM) tables, which have no XID.
+
+    Events are told apart by their class name, so that recorded events
+    replay just like the ones of :py:class:`pymysqlreplication.BinLogStreamReader`.
+    """
+    changes = []
+    for event in stream:
+        kind = event.__class__.__name__
+        if kind == 'XidEvent' or (kind == 'QueryEvent' and event.query.strip().upper() == 'COMMIT'):
+            yield (stream.log_file, stream.log_pos), changes
+            changes = []
+        elif kind == 'WriteRowsEvent':
+            changes.extend((event.table, None, row['values']) for row in event.rows)
+        elif kind == 'UpdateRowsEvent':
+            changes.extend((event.table, row['before_values'], row['after_values']) for row in event.rows)
+        elif kind == 'DeleteRowsEvent':
+            changes.extend((event.table, row['values'], None) for row in event.rows)
+
+
+def row_values(table, values):
+    """Turns the `values` of a binlog row image of `table` in a row as
+    read by :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader`, so that
+    the writers convert it like any other.
+    """
+    row = []
+    for column in table.columns:
+        value = values.get(column['name'])
+        if value is None:
+            pass
+        elif isinstance(value, (set, frozenset)):
+            value = ','.join(sorted(value))
+        elif isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        elif column['type'].startswith('bit'):
+            # the binlog has bits as a '0101' string, MySQLdb as bytes
+            bits = int(value, 2)
+            value = ('%0*x' % ((len(value) + 7) // 8 * 2, bits)).decode('hex')
+        row.append(value)
+    return tuple(row)
+
+
+class ChangeApplier(object):
+    """Applies the row changes of the MySQL binlog to the converted
+    tables, in batches of `batch_size` changes.
+
+    Each batch keeps only the last image of every row it changes, then
+    per table deletes the rows gone and upserts the others through
+    :py:meth:`mysql2pgsql.lib.postgres_db_writer.PostgresDbWriter.upsert_rows`.
+    The binlog position reached is recorded in a state table once the
+    batch is in. Applying the same changes twice leaves the same rows, so
+    a batch interrupted halfway is simply applied again from there.
+
+    Tables without a primary key can't have their rows told apart and
+    their changes are skipped.
+
+    :Parameters:
+      - `writer`: the :py:class:`mysql2pgsql.lib.postgres_db_writer.PostgresDbWriter` the changes are written with
+      - `tables`: the :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader.Table` objects whose changes are applied
+      - `batch_size`: number of row changes applied per batch
+      - `verbose`: whether or not to log progress to :py:obj:`stdout`
+    """
+    table_name = 'mysql2pgsql_binlog'
+
+    def __init__(self, writer, tables, batch_size=1000, verbose=False):
+        self.writer = writer
+        self.tables = dict((t.name, t) for t in tables)
+        self.batch_size = batch_size
+        self.verbose = verbose
+        self.skipped = set()
+
+    def setup(self):
+        """Creates the state table if needed"""
+        self.writer.execute("""CREATE TABLE IF NOT EXISTS "%s" (
+            id boolean PRIMARY KEY DEFAULT true CHECK (id),
+            log_file text NOT NULL,
+            log_pos bigint NOT NULL,
+            recorded_at timestamp with time zone NOT NULL DEFAULT now());""" % self.table_name)
+
+    def position(self):
+        """The `(log_file, log_pos)` binlog position changes were applied up to,
+        None if none was recorded
+        """
+        with closing(self.writer.conn.cursor()) as cur:
+            cur.execute('SELECT log_file, log_pos FROM "%s"' % self.table_name)
+            row = cur.fetchone()
+        self.writer.conn.commit()
+        return (row[0], int(row[1])) if row else None
+
+    def record(self, position):
+        self.writer.execute("""INSERT INTO "%s" (log_file, log_pos) VALUES (%%s, %%s)
+            ON CONFLICT (id) DO UPDATE
+            SET log_file = EXCLUDED.log_file, log_pos = EXCLUDED.log_pos, recorded_at = now();""" % self.table_name,
+                            position)
+
+    def apply(self, transactions):
+        """Applies `transactions`, as yielded by :py:func:`transactions`.
+
+        Returns the number of row changes applied.
+        """
+        batch, size, applied, position = OrderedDict(), 0, 0, None
+        for position, changes in transactions:
+            for table_name, before, after in changes:
+                table = self.tables.get(table_name)
+                if table is None:
+                    continue
+                if not table.primary_key:
+                    if table_name not in self.skipped:
+                        print_red('SKIPPING CHANGES TO %s, IT HAS NO PRIMARY KEY' % table_name)
+                        self.skipped.add(table_name)
+                    continue
+                rows = batch.setdefault(table_name, OrderedDict())
+                if before is not None:
+                    rows[self.key(table, row_values(table, before))] = None
+                if after is not None:
+                    row = row_values(table, after)
+                    rows[self.key(table, row)] = row
+                size += 1
+            if size >= self.batch_size:
+                self.flush(batch, position)
+                batch, applied, size = OrderedDict(), applied + size, 0
+        if position is not None:
+            self.flush(batch, position)
+        return applied + size
+
+    def key(self, table, row):
+        names = [c['name'] for c in table.columns]
+        return tuple(row[names.index(name)] for name in table.primary_key)
+
+    def flush(self, batch, position):
+        for table_name, rows in batch.items():
+            table = self.tables[table_name]
+            deleted = [key for key, row in rows.items() if row is None]
+            upserted = [row for row in rows.values() if row is not None]
+            self.writer.upsert_rows(table, upserted, deleted)
+            if self.verbose:
+                print_table_actions('APPLIED %s CHANGES TO %s' % (len(rows), table_name))
+        self.record(position)
@@ -0,0 +1,107 @@
+from __future__ import with_statement, absolute_import
+
+from collections import defaultdict
+from contextlib import closing
+
+
+class Checkpoint(object):
+    """Journal of the completed steps of a migration, kept in a state
+    table of the destination database so that a failed run can be
+    resumed instead of started over.
+
+    Each table records the phases it went through (`table`, `indexes`,
+    `constraints`, `triggers`), the key ranges or partitions its data was
+    split in (`plan`) and every range whose copy was committed (`chunk`). Chunks
+    are recorded in the same transaction as their ``COPY``, so a range is
+    either fully copied and journaled or not at all.
+
+    :Parameters:
+      - `writer`: the :py:class:`mysql2pgsql.lib.postgres_db_writer.PostgresDbWriter` whose connection is used
+    """
+    table_name = 'mysql2pgsql_checkpoint'
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.phases = set()
+        self.plans = defaultdict(list)
+        self.chunks = defaultdict(set)
+
+    def setup(self):
+        """Creates the state table if needed and loads what it holds"""
+        self.writer.execute("""CREATE TABLE IF NOT EXISTS "%s" (
+            table_name text NOT NULL,
+            phase text NOT NULL,
+            lower_key numeric,
+            upper_key numeric,
+            partition_name text,
+            recorded_at timestamp with time zone NOT NULL DEFAULT now());""" % self.table_name)
+        with closing(self.writer.conn.cursor()) as cur:
+            cur.execute('SELECT table_name, phase, lower_key, upper_key, partition_name FROM "%s" ORDER BY recorded_at'
+                        % self.table_name)
+            for table_name, phase, lower, upper, partition in cur:
+                key_range = partition or ((_key(lower), _key(upper)) if (lower, upper) != (None, None) else None)
+                if phase == 'plan':
+                    self.plans[table_name].append(key_range)
+                elif phase == 'chunk':
+                    self.chunks[table_name].add(key_range)
+                else:
+                    self.phases.add((table_name, phase))
+        self.writer.conn.commit()
+
+    def clear(self):
+        """Drops the state table, once the migration went through"""
+        self.writer.execute('DROP TABLE IF EXISTS "%s";' % self.table_name)
+
+    def done(self, table_name, phase):
+        """Whether `phase` of `table_name` completed in a previous run"""
+        return (table_name, phase) in self.phases
+
+    def started(self, table_name):
+        """Whether some data of `table_name` was already copied"""
+        return bool(self.chunks[table_name])
+
+    def plan(self, table_name):
+        """Key ranges `table_name` was split in by a previous run, None if unknown"""
+        return self.plans.get(table_name) or None
+
+    def pending(self, table_name, key_ranges):
+        """The `key_ranges` of `table_name` that still have to be copied"""
+        done = self.chunks[table_name]
+        return [key_range for key_range in key_ranges if key_range not in done]
+
+    def record_plan(self, table_name, key_ranges):
+        """Journals the `key_ranges` `table_name` is split in, in one
+        transaction: a partial plan would leave the other ranges uncopied
+        on resume.
+        """
+        try:
+            with closing(self.writer.conn.cursor()) as cur:
+                for key_range in key_ranges:
+                    self.record(table_name, 'plan', key_range, cur)
+        except:
+            self.writer.conn.rollback()
+            raise
+        self.writer.conn.commit()
+        self.plans[table_name] = list(key_ranges)
+
+    def record(self, table_name, phase, key_range=None, cursor=None):
+        """Journals `phase` of `table_name`. Given a `cursor` the entry joins
+        its transaction, otherwise it is committed right away.
+        """
+        partition = key_range if isinstance(key_range, basestring) else None
+        lower, upper = key_range if key_range and not partition else (None, None)
+        sql = ('INSERT INTO "%s" (table_name, phase, lower_key, upper_key, partition_name) '
+               'VALUES (%%s, %%s, %%s, %%s, %%s);' % self.table_name)
+        args = (table_name, phase, lower, upper, partition)
+        if cursor is None:
+            self.writer.execute(sql, args)
+        else:
+            cursor.execute(sql, args)
+        if phase == 'chunk':
+            self.chunks[table_name].add(key_range)
+        elif phase != 'plan':
+            self.phases.add((table_name, phase))
+
+
+def _key(value):
+    return None if value is None else int(value)
@@ -50,15 +50,51 @@ mysql:
  password: 
  database: mysql2psql_test
  compress: false
+ # load the definition of all tables from information_schema in a few queries
+ # instead of running several SHOW queries per table, faster on large schemas
+ bulk_introspection: false
+ # read all the data as of a single point in time, even with several workers: writes are
+ # blocked with FLUSH TABLES WITH READ LOCK while the workers start their snapshots
+ consistent_snapshot: false
+ # when false, text is read as raw UTF-8 bytes and copied as is, instead of being decoded
+ # to unicode and encoded back. faster on text heavy tables
+ use_unicode: true
+ # rows fetched from the server at once when reading table data
+ fetch_size: 1000
+ # read partitioned tables partition by partition and create them as partitioned tables
+ # (postgres 11 or later). when false they are read and created as plain tables
+ partitions: false
+ # session variables set on every connection, e.g. longer timeouts over slow or distant links.
+ # max_allowed_packet and net_buffer_length are read only per session, raise them on the server
+ #session_variables:
+ # net_read_timeout: 600
+ # net_write_timeout: 600
 destination:
  # if file is given, output goes to file, else postgres
  file: 
+ # if directory is given, output goes to a directory of schema, data and post-data files
+ # that can be restored in parallel, else postgres
+ directory: 
+ # compression of the data files of directory: gzip, zstd, lz4 or none
+ compression: gzip
  postgres:
   hostname: localhost
   port: 5432
   username: mysql2psql
   password: 
   database: mysql2psql_test
+  # 'text' or 'binary'. binary copy sends integers, timestamps, numerics and bytea
+  # in their wire format instead of escaped text
+  copy_format: text
+  # memory each connection may use to build an index, e.g. 1GB. leave empty for the server default
+  maintenance_work_mem:
+  # connections kept open between uses and shared by the threads building indexes or restoring
+  # a dump, e.g. index_workers + 1. data workers are processes, each has a connection of its own
+  pool_size: 1
+  # 'logged', 'unlogged' or 'truncate'. unlogged creates the tables without write ahead logging
+  # and switches them to logged once indexed. truncate empties each table in the transaction
+  # of its copy, which skips the wal when the server runs with wal_level = minimal
+  load_strategy: logged
 
 # if tables is given, only the listed tables will be converted.  leave empty to convert all tables.
 #only_tables:
@@ -84,4 +120,60 @@ timezone: false
 # if index_prefix is given, indexes will be created whith a name prefixed with index_prefix
 index_prefix:
 
+# when above 0, rows are converted column by column in batches of that many rows instead of
+# one at a time, which is faster for tables of numbers, dates and short text. e.g. 5000
+batch_size: 0
+
+# read rows from mysql, convert them and send them to postgres each in a thread of their own,
+# so that waiting on either server overlaps with converting
+pipeline: false
+
+# number of processes loading table data in parallel, each with its own mysql and postgres
+# connections. only used when writing to postgres or a directory, largest tables are loaded first
+workers: 1
+
+# when loading with several workers, tables with a single column integer primary key
+# are split in this many key ranges, each one copied by its own worker
+chunks: 1
+
+# number of postgres connections building primary keys, indexes and foreign keys at once,
+# once all the data is loaded. only used when writing to postgres
+index_workers: 1
+
+# journal the progress in a mysql2pgsql_checkpoint table of the destination database, so that
+# a failed run picks up where it stopped. only used when writing to postgres, the table is
+# dropped once a run completes
+checkpoint: false
+
+# load tables in full the first time, then only bring them up to date on the following runs:
+# rows at or past the watermark of a table are upserted on its primary key. watermarks are
+# kept in a mysql2pgsql_watermarks table of the destination database. only used when writing
+# to postgres
+incremental: false
+
+# watermark column of the tables synced by incremental runs, usually an updated_at timestamp.
+# tables not listed here use their auto increment column, the others are synced in full
+#watermark_columns:
+#  table1: updated_at
+
+# record the binlog position the data was read at, so that running with --tail afterwards
+# applies the changes made since. needs row based binlogs with full row images, the
+# mysql-replication package and writing to postgres
+cdc: false
+
+# server id --tail registers with as a binlog client, unique among the replicas of the server
+cdc_server_id: 4242
+
+# row changes --tail applies per batch
+cdc_batch_size: 1000
+
+# file the wall time of every phase of every table (introspection, ddl, data, indexes,
+# constraints, triggers) is appended to as json lines, with the rows, bytes and seconds spent
+# reading from mysql, converting and copying of the data phase. a summary is printed at the end
+metrics:
+
+# directory the conversion is profiled to with cprofile, same as the --profile option: a pstats
+# file of the data of every table, one of the whole run and a report of the slowest functions
+profile:
+
 """
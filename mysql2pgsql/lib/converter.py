@@ -1,9 +1,25 @@
 from __future__ import absolute_import
 
-from . import print_start_table
+import time
+from functools import partial
+from multiprocessing import Event, Pool, Queue
+from Queue import Empty
+
+from . import print_start_table, print_table_actions
+from . import binlog, parallel
+from .checkpoint import Checkpoint
+from .errors import GeneralException
+from .incremental import Watermarks
+from .index_builder import IndexBuilder
+from .metrics import Metrics
+from .postgres_db_writer import PostgresDbWriter
+from .postgres_directory_writer import PostgresDirectoryWriter
 
 
 class Converter(object):
+    # seconds the workers have to start their snapshot while writes are locked
+    snapshot_timeout = 60
+
     def __init__(self, reader, writer, file_options, verbose=False):
         self.verbose = verbose
         self.reader = reader
@@ -15,21 +31,54 @@ class Converter(object):
         self.supress_data = file_options.get('supress_data', None)
         self.force_truncate = file_options.get('force_truncate', None)
         self.index_prefix = file_options.get('index_prefix', u"")
+        self.workers = file_options.get('workers', None) or 1
+        self.chunks = file_options.get('chunks', None) or 1
+        self.index_workers = file_options.get('index_workers', None) or 1
+        self.metrics = None
+        if file_options.get('metrics', None):
+            self.metrics = writer.metrics = Metrics(file_options['metrics'])
+        self.checkpoint = None
+        if file_options.get('checkpoint', None) and isinstance(writer, PostgresDbWriter):
+            self.checkpoint = writer.checkpoint = Checkpoint(writer)
+        self.cdc = file_options.get('cdc', None) and isinstance(writer, PostgresDbWriter)
+        self.consistent_snapshot = file_options.get('mysql', {}).get('consistent_snapshot', None)
+        self.unlogged = isinstance(writer, PostgresDbWriter) and writer.unlogged
+        if (isinstance(writer, PostgresDbWriter) and writer.load_strategy == 'truncate' and self.supress_ddl
+                and not self.supress_data):
+            raise GeneralException('the truncate load_strategy empties the tables it loads, '
+                                   'it needs the tables to be created by the conversion')
+        self.pool = None
+        self.watermarks = None
+        if file_options.get('incremental', None) and isinstance(writer, PostgresDbWriter):
+            self.watermarks = Watermarks(writer, file_options.get('watermark_columns', None))
 
     def convert(self):
         if self.verbose:
             print_start_table('>>>>>>>>>> STARTING <<<<<<<<<<\n\n')
 
-        tables = [t for t in (t for t in self.reader.tables if t.name not in self.exclude_tables) if not self.only_tables or t.name in self.only_tables]
-        if self.only_tables:
-            tables.sort(key=lambda t: self.only_tables.index(t.name))
-        
+        if self.cdc or self.consistent_snapshot:
+            position = self.snapshot()
+            if self.cdc and not position:
+                raise GeneralException('cdc needs binary logging enabled on the MySQL server')
+
+        tables = self.tables()
+
+        if self.checkpoint:
+            self.checkpoint.setup()
+
+        synced, marks = [], []
+        if self.watermarks:
+            self.watermarks.setup()
+            synced = [t for t in tables if self.watermarks.known(t.name)]
+            tables = [t for t in tables if not self.watermarks.known(t.name)]
+
         if not self.supress_ddl:
             if self.verbose:
                 print_start_table('START CREATING TABLES')
 
-            for table in tables:
+            for table in self.pending(tables, 'table'):
                 self.writer.write_table(table)
+                self.done(table, 'table')
 
             if self.verbose:
                 print_start_table('DONE CREATING TABLES')
@@ -39,7 +88,8 @@ class Converter(object):
                 print_start_table('START TRUNCATING TABLES')
 
             for table in tables:
-                self.writer.truncate(table)
+                if not (self.checkpoint and self.checkpoint.started(table.name)):
+                    self.writer.truncate(table)
 
             if self.verbose:
                 print_start_table('DONE TRUNCATING TABLES')
@@ -48,8 +98,21 @@ class Converter(object):
             if self.verbose:
                 print_start_table('START WRITING TABLE DATA')
 
-            for table in tables:
-                self.writer.write_contents(table, self.reader)
+            if self.watermarks:
+                marks = [(table, self.watermarks.current(self.reader, table)) for table in tables]
+
+            if self.parallel_data:
+                self.write_contents_parallel(tables)
+            elif self.checkpoint:
+                for table in tables:
+                    for key_range in parallel.key_ranges(table, self.reader, self.chunks, self.checkpoint)[1]:
+                        self.writer.write_contents(table, self.reader, key_range)
+            else:
+                for table in tables:
+                    self.writer.write_contents(table, self.reader)
+
+            if self.watermarks:
+                self.sync_contents(synced)
 
             if self.verbose:
                 print_start_table('DONE WRITING TABLE DATA')
@@ -58,19 +121,185 @@ class Converter(object):
             if self.verbose:
                 print_start_table('START CREATING INDEXES, CONSTRAINTS, AND TRIGGERS')
 
-            for table in tables:
-                self.writer.write_indexes(table)
+            if self.index_workers > 1 and isinstance(self.writer, PostgresDbWriter):
+                IndexBuilder(partial(parallel.open_writer, self.file_options, pool=self.writer.pool), self.index_workers,
+                             self.checkpoint, self.verbose, self.metrics).build(self.pending(tables, 'indexes'),
+                                                                  self.pending(tables, 'constraints'),
+                                                                  self.pending(tables, 'logged') if self.unlogged else [])
+            else:
+                for table in self.pending(tables, 'indexes'):
+                    self.writer.write_indexes(table)
+                    self.done(table, 'indexes')
 
-            for table in tables:
-                self.writer.write_constraints(table)
+                # unlogged tables can't be referenced by foreign keys of logged ones
+                if self.unlogged:
+                    for table in self.pending(tables, 'logged'):
+                        self.writer.set_logged(table)
+                        self.done(table, 'logged')
 
-            for table in tables:
+                for table in self.pending(tables, 'constraints'):
+                    self.writer.write_constraints(table)
+                    self.done(table, 'constraints')
+
+            for table in self.pending(tables, 'triggers'):
                 self.writer.write_triggers(table)
+                self.done(table, 'triggers')
 
             if self.verbose:
                 print_start_table('DONE CREATING INDEXES, CONSTRAINTS, AND TRIGGERS')
 
+        # only once their keys exist are the new tables synced by the next runs, which upsert on them
+        for table, mark in marks:
+            self.watermarks.record(table.name, mark)
+
         if self.verbose:
             print_start_table('\n\n>>>>>>>>>> FINISHED <<<<<<<<<<')
 
+        if self.cdc:
+            applier = binlog.ChangeApplier(self.writer, tables)
+            applier.setup()
+            applier.record(position)
+
+        if self.checkpoint:
+            self.checkpoint.clear()
+
         self.writer.close()
+
+        if self.metrics:
+            self.metrics.close()
+            print(self.metrics.summary())
+
+    @property
+    def parallel_data(self):
+        """Whether table data is loaded by a pool of `workers` processes"""
+        return (self.workers > 1 and isinstance(self.writer, (PostgresDbWriter, PostgresDirectoryWriter))
+                and not self.supress_data)
+
+    def snapshot(self):
+        """Has the data read within one consistent snapshot.
+
+        The reader connection starts a snapshot transaction. When the data is
+        loaded by several workers and `consistent_snapshot` is set, writes to
+        the server are locked meanwhile and the pool of workers is started,
+        each with its own snapshot of the same point, then unlocked right away.
+
+        Returns the binlog position of the snapshot when `cdc` is enabled.
+        Without the lock it is read right before the snapshot is.
+        """
+        lock = self.consistent_snapshot and self.parallel_data
+        if lock:
+            self.reader.lock()
+        try:
+            position = self.reader.binlog_position() if self.cdc else None
+            self.reader.snapshot()
+            if lock:
+                self.pool = self.open_pool(consistent=True)
+        finally:
+            if lock:
+                self.reader.unlock()
+        return position
+
+    def open_pool(self, consistent=False):
+        """Starts the pool of `workers` processes loading data. When
+        `consistent`, it returns once each of them started its snapshot.
+        A worker dying afterwards aborts the conversion: the one the pool
+        starts in its place could only read later data.
+        """
+        ready, started = (Queue(), Event()) if consistent else (None, None)
+        pool = Pool(self.workers, parallel.init_worker, (self.file_options, ready, started))
+        if ready:
+            deadline = time.time() + self.snapshot_timeout
+            try:
+                for _ in range(self.workers):
+                    ready.get(timeout=max(deadline - time.time(), 0))
+            except Empty:
+                pool.terminate()
+                raise GeneralException('the workers could not start their snapshot in %ss' % self.snapshot_timeout)
+            started.set()
+        return pool
+
+    def tables(self):
+        """The tables to convert, after `only_tables` and `exclude_tables`"""
+        names = [n for n in self.reader.table_names if n not in self.exclude_tables and (not self.only_tables or n in self.only_tables)]
+        if self.only_tables:
+            names.sort(key=lambda n: self.only_tables.index(n))
+        if not self.metrics:
+            return [self.reader.Table(self.reader, n) for n in names]
+        tables = []
+        for name in names:
+            # tables are read lazily, load them here so that the time is not charged to their ddl
+            with self.metrics.phase(name, 'introspection'):
+                tables.append(self.reader.Table(self.reader, name).load())
+        return tables
+
+    def tail(self, poll_interval=1.0):
+        """Applies the changes logged in the MySQL binlog since the data
+        was read by a conversion with `cdc` enabled, then keeps polling for
+        more until interrupted.
+        """
+        if binlog.BinLogStreamReader is None:
+            raise GeneralException('tailing the binlog needs the mysql-replication package')
+        applier = binlog.ChangeApplier(self.writer, self.tables(), self.file_options.get('cdc_batch_size', None) or 1000,
+                                       self.verbose)
+        applier.setup()
+        if not applier.position():
+            raise GeneralException('no binlog position recorded, run a conversion with cdc enabled first')
+        if self.verbose:
+            print_start_table('>>>>>>>>>> TAILING THE BINLOG FROM %s:%s <<<<<<<<<<' % applier.position())
+        try:
+            while True:
+                stream = binlog.open_stream(self.file_options['mysql'], applier.position(),
+                                            self.file_options.get('cdc_server_id', None) or 4242)
+                try:
+                    applied = applier.apply(binlog.transactions(stream))
+                finally:
+                    stream.close()
+                if not applied:
+                    time.sleep(poll_interval)
+        finally:
+            self.writer.close()
+
+    def pending(self, tables, phase):
+        """The `tables` whose `phase` wasn't completed by a previous run"""
+        if not self.checkpoint:
+            return tables
+        return [table for table in tables if not self.checkpoint.done(table.name, phase)]
+
+    def done(self, table, phase):
+        if self.checkpoint:
+            self.checkpoint.record(table.name, phase)
+
+    def sync_contents(self, tables):
+        """Upserts the rows of `tables`, loaded by a previous incremental run,
+        that are past their watermark and moves the watermark forward in the
+        same transaction.
+        """
+        for table in tables:
+            mark = self.watermarks.current(self.reader, table)
+            self.writer.sync_contents(table, self.reader, self.watermarks.since(table),
+                                      lambda cur: self.watermarks.record(table.name, mark, cur))
+
+    def write_contents_parallel(self, tables):
+        """Copies the data of `tables` over a pool of `workers` processes,
+        each one with its own MySQL and PostgreSQL connections, or data
+        files when dumping to a directory. Tables,
+        or key ranges of them when `chunks` is set, are handed out
+        largest first, one at a time.
+        """
+        pool, self.pool = self.pool or self.open_pool(), None
+        try:
+            units = parallel.work_units(tables, self.reader, self.chunks, self.checkpoint)
+            for name, key_range, result, records in pool.imap_unordered(parallel.write_contents, units):
+                for record in records:
+                    self.metrics.add(record)
+                if isinstance(self.writer, PostgresDirectoryWriter):
+                    self.writer.add_contents(result)
+                if self.verbose:
+                    print_table_actions('FINISH - WRITING DATA TO %s%s' % (
+                        name, ' %s' % (key_range, ) if key_range else ''))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
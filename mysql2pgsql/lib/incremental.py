@@ -0,0 +1,84 @@
+from __future__ import with_statement, absolute_import
+
+from contextlib import closing
+
+
+class Watermarks(object):
+    """High-water marks of incremental runs, kept per table in a state
+    table of the destination database.
+
+    A table is synced by its watermark column: the one configured for it,
+    else its auto increment column. Every run records the highest value
+    that column had before the table was read, so that the next run only
+    reads the rows from there on. Rows sharing that very value are read
+    again, which the upsert makes harmless, rather than missing the ones
+    written in the same second. Tables without such a column are synced
+    in full.
+
+    :Parameters:
+      - `writer`: the :py:class:`mysql2pgsql.lib.postgres_db_writer.PostgresDbWriter` whose connection is used
+      - `columns`: optional :py:obj:`dict` of the watermark column of each table name
+    """
+    table_name = 'mysql2pgsql_watermarks'
+
+    def __init__(self, writer, columns=None):
+        self.writer = writer
+        self.columns = columns or {}
+        self.marks = {}
+
+    def setup(self):
+        """Creates the state table if needed and loads the recorded marks"""
+        self.writer.execute("""CREATE TABLE IF NOT EXISTS "%s" (
+            table_name text PRIMARY KEY,
+            column_name text,
+            value text,
+            synced_at timestamp with time zone NOT NULL DEFAULT now());""" % self.table_name)
+        with closing(self.writer.conn.cursor()) as cur:
+            cur.execute('SELECT table_name, column_name, value FROM "%s"' % self.table_name)
+            self.marks = dict((table_name, (column, value)) for table_name, column, value in cur)
+        self.writer.conn.commit()
+
+    def known(self, table_name):
+        """Whether `table_name` was loaded by a previous incremental run"""
+        return table_name in self.marks
+
+    def column(self, table):
+        """Name of the watermark column of `table`, None if it has none"""
+        if table.name in self.columns:
+            return self.columns[table.name]
+        return next((c['name'] for c in table.columns if c['auto_increment']), None)
+
+    def since(self, table):
+        """The `(column, value)` watermark the rows of `table` have to be at
+        or past to be synced, see :py:meth:`mysql2pgsql.lib.mysql_reader.MysqlReader.read`.
+        None when all of them have to, the first time or when its column changed.
+        """
+        column, value = self.marks.get(table.name, (None, None))
+        if column is None or value is None or column != self.column(table):
+            return None
+        definition = next((c for c in table.columns if c['name'] == column), None)
+        if definition and definition['type'] in ('tinyint', 'integer', 'bigint'):
+            value = int(value)
+        return column, value
+
+    def current(self, reader, table):
+        """Returns the `(column, value)` watermark `table` is at in MySQL"""
+        column = self.column(table)
+        return column, reader.watermark(table, column) if column else None
+
+    def record(self, table_name, mark, cursor=None):
+        """Stores the `(column, value)` watermark of `table_name`. Given a
+        `cursor` it joins its transaction, otherwise it is committed right away.
+        """
+        column, value = mark
+        if value is not None:
+            value = unicode(value)
+        sql = """INSERT INTO "%s" (table_name, column_name, value) VALUES (%%s, %%s, %%s)
+            ON CONFLICT (table_name) DO UPDATE
+            SET column_name = EXCLUDED.column_name, value = EXCLUDED.value, synced_at = now();""" % self.table_name
+        args = (table_name, column, value)
+        if cursor is None:
+            self.writer.execute(sql, args)
+        else:
+            cursor.execute(sql, args)
+        self.marks[table_name] = column, value
@@ -0,0 +1,197 @@
+from __future__ import with_statement, absolute_import
+
+import sys
+import threading
+import time
+
+from . import print_table_actions
+from .postgres_writer import PostgresWriter
+
+
+class IndexBuilder(object):
+    """Builds the primary keys, indexes and foreign keys of loaded tables
+    over several PostgreSQL connections at once.
+
+    Every primary key, index and the foreign keys of every table are
+    separate tasks. Indexes of a table are built once its primary key is
+    in, all at once since ``CREATE INDEX`` lets others run on the same
+    table, and foreign keys wait for every index of both the table and
+    the tables it references. Tables loaded UNLOGGED are switched to
+    LOGGED once their indexes are in, before any foreign key refers to
+    them. Tasks taking conflicting table locks, such
+    as two ``ALTER TABLE`` of the same table, never run together so the
+    connections don't deadlock each other.
+
+    :Parameters:
+      - `open_writer`: callable returning a new :py:class:`mysql2pgsql.lib.postgres_db_writer.PostgresDbWriter`, called once per connection
+      - `workers`: number of connections building at once
+      - `checkpoint`: optional :py:class:`mysql2pgsql.lib.checkpoint.Checkpoint` the completed phases are journaled to
+      - `verbose`: whether or not to log progress to :py:obj:`stdout`
+      - `metrics`: optional :py:class:`mysql2pgsql.lib.metrics.Metrics` every task is measured with
+    """
+    class Task(object):
+        def __init__(self, description, statements, table_name, phase, locks=(), after=()):
+            self.description = description
+            self.statements = statements
+            self.table_name = table_name
+            self.phase = phase
+            self.locks = set(locks)
+            self.after = set(after)
+
+    def __init__(self, open_writer, workers, checkpoint=None, verbose=False, metrics=None):
+        self.open_writer = open_writer
+        self.workers = workers
+        self.checkpoint = checkpoint
+        self.verbose = verbose
+        self.metrics = metrics
+
+    def tasks(self, writer, index_tables, constraint_tables, logged_tables=()):
+        """Returns the tasks building the indexes of `index_tables`,
+        switching `logged_tables` to LOGGED and adding the foreign keys of
+        `constraint_tables`, as generated by the :py:class:`PostgresWriter`
+        methods of `writer`.
+        """
+        return self.statement_tasks(
+            [(table.name, ) + PostgresWriter.index_statements(writer, table) for table in index_tables],
+            [(table.name, PostgresWriter.write_constraints(writer, table), [key['ref_table'] for key in table.foreign_keys])
+             for table in constraint_tables],
+            logged=[(table.name, PostgresWriter.set_logged(writer, table)) for table in logged_tables])
+
+    def statement_tasks(self, indexes, constraints, triggers=(), logged=()):
+        """Returns the tasks running the given statements.
+
+        :Parameters:
+          - `indexes`: `(table_name, primary_sql, index_sql)` tuples, as returned by :py:meth:`PostgresWriter.index_statements`
+          - `constraints`: `(table_name, constraint_sql, referenced_table_names)` tuples
+          - `triggers`: `(table_name, trigger_sql)` tuples
+          - `logged`: `(table_name, logged_sql)` tuples, as returned by :py:meth:`PostgresWriter.set_logged`
+        """
+        tasks = []
+        index_tasks = {}
+        for table_name, primary_sql, index_sql in indexes:
+            primary = []
+            if primary_sql:
+                primary = [self.Task('ADDING PRIMARY KEY TO %s' % table_name, primary_sql,
+                                     table_name, 'indexes', locks=[table_name])]
+            index_tasks[table_name] = primary + [
+                self.Task('ADDING INDEX %s' % statements[-1].split('"')[1], statements,
+                          table_name, 'indexes', after=primary)
+                for statements in index_sql]
+            tasks.extend(index_tasks[table_name])
+
+        logged_tasks = {}
+        for table_name, logged_sql in logged:
+            logged_tasks[table_name] = [self.Task('SWITCHING %s TO LOGGED' % table_name, logged_sql, table_name, 'logged',
+                                                  locks=[table_name], after=index_tasks.get(table_name, []))]
+            tasks.extend(logged_tasks[table_name])
+
+        for table_name, constraint_sql, referenced in constraints:
+            if not constraint_sql:
+                continue
+            related = set([table_name] + list(referenced))
+            after = [task for name in related for task in index_tasks.get(name, []) + logged_tasks.get(name, [])]
+            tasks.append(self.Task('ADDING CONSTRAINTS ON %s' % table_name, constraint_sql,
+                                   table_name, 'constraints', locks=related, after=after))
+
+        for table_name, trigger_sql in triggers:
+            if trigger_sql:
+                tasks.append(self.Task('ADDING TRIGGERS ON %s' % table_name, trigger_sql,
+                                       table_name, 'triggers', locks=[table_name]))
+        return tasks
+
+    def build(self, index_tables, constraint_tables, logged_tables=()):
+        """Adds the indexes of `index_tables`, switches `logged_tables`
+        to LOGGED then, as soon as their indexes allow it, adds the foreign
+        keys of `constraint_tables`. The first failure stops the build and
+        is raised once the running tasks are over.
+        """
+        writer = self.open_writer()
+        try:
+            tasks = self.tasks(writer, index_tables, constraint_tables, logged_tables)
+        finally:
+            writer.close()
+        self.run(tasks, [(table.name, 'indexes') for table in index_tables] +
+                 [(table.name, 'logged') for table in logged_tables] +
+                 [(table.name, 'constraints') for table in constraint_tables])
+
+    def run(self, tasks, phases=()):
+        """Runs `tasks` over the connections, recording each of the
+        `(table_name, phase)` `phases` to the checkpoint once its tasks
+        are done. The first failure stops the run and is raised once the
+        running tasks are over.
+        """
+        self.waiting = list(tasks)
+        self.remaining = {}
+        for task in self.waiting:
+            key = task.table_name, task.phase
+            self.remaining[key] = self.remaining.get(key, 0) + 1
+        for key in phases:
+            if key not in self.remaining:
+                self.record(*key)
+
+        self.finished = set()
+        self.locked = set()
+        self.error = None
+        self.condition = threading.Condition()
+        threads = [threading.Thread(target=self.work) for _ in range(min(self.workers, len(self.waiting)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.error:
+            raise self.error[0], self.error[1], self.error[2]
+
+    def record(self, table_name, phase):
+        if self.checkpoint:
+            self.checkpoint.record(table_name, phase)
+
+    def next_task(self):
+        """Takes the first waiting task that can start, if any"""
+        for task in self.waiting:
+            if task.after <= self.finished and not task.locks & self.locked:
+                self.waiting.remove(task)
+                self.locked |= task.locks
+                return task
+
+    def execute(self, writer, task):
+        if self.metrics:
+            with self.metrics.phase(task.table_name, task.phase):
+                writer.execute(task.statements)
+        else:
+            writer.execute(task.statements)
+
+    def work(self):
+        writer = None
+        try:
+            writer = self.open_writer()
+            while True:
+                with self.condition:
+                    task = None
+                    while self.waiting and not self.error:
+                        task = self.next_task()
+                        if task:
+                            break
+                        self.condition.wait()
+                    if not task:
+                        return
+                if self.verbose:
+                    print_table_actions('START  - %s' % task.description)
+                    start = time.time()
+                self.execute(writer, task)
+                if self.verbose:
+                    print_table_actions('FINISH - %s in %.2fs' % (task.description, time.time() - start))
+                with self.condition:
+                    self.finished.add(task)
+                    self.locked -= task.locks
+                    key = task.table_name, task.phase
+                    self.remaining[key] -= 1
+                    if not self.remaining[key]:
+                        self.record(*key)
+                    self.condition.notify_all()
+        except:
+            with self.condition:
+                self.error = self.error or sys.exc_info()
+                self.condition.notify_all()
+        finally:
+            if writer:
+                writer.close()
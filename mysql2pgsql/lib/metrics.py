@@ -0,0 +1,161 @@
+from __future__ import with_statement, absolute_import
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import imap
+
+# phases of the conversion of a table, in the order they run
+PHASES = ('introspection', 'ddl', 'data', 'indexes', 'logged', 'constraints', 'triggers')
+
+# counters of the data phases, on top of their wall time
+COUNTERS = ('rows', 'bytes', 'fetch', 'convert', 'copy')
+
+
+class Stage(object):
+    """The measures of one phase of one table while it runs.
+
+    Data phases also count the rows and bytes of copy data they go
+    through, and split their wall time between reading the rows from
+    MySQL (`fetch`), converting them (`convert`) and writing the copy
+    data out (`copy`), see :py:meth:`fetching`, :py:meth:`converting`
+    and :py:meth:`waiting`. Bytes are counted before the text is encoded
+    to UTF-8, so characters outside of ASCII count as one.
+    """
+    def __init__(self, table_name, phase):
+        self.table_name = table_name
+        self.phase = phase
+        self.start = time.time()
+        self.blocks = False
+        self.rows = self.bytes = 0
+        self.fetch = self.convert = self.wait = 0.0
+
+    def fetching(self, blocks):
+        """Iterates the blocks of rows read from MySQL, timing the reads"""
+        self.blocks = True
+        blocks = iter(blocks)
+        while True:
+            start = time.time()
+            block = next(blocks, None)
+            self.fetch += time.time() - start
+            if block is None:
+                return
+            self.rows += len(block)
+            yield block
+
+    def converting(self, encode):
+        """Wraps `encode`, turning a block of rows into its lines of copy data, to time it"""
+        def timed(block):
+            start = time.time()
+            lines = encode(block)
+            self.convert += time.time() - start
+            self.bytes += sum(imap(len, lines))
+            return lines
+        return timed
+
+    def waiting(self, blocks):
+        """Iterates the blocks of lines of copy data, timing how long the
+        writer waits for them. Whatever else the phase takes is spent
+        writing the data out.
+        """
+        blocks = iter(blocks)
+        while True:
+            start = time.time()
+            block = next(blocks, None)
+            self.wait += time.time() - start
+            if block is None:
+                return
+            yield block
+
+    def record(self):
+        seconds = time.time() - self.start
+        record = OrderedDict([('table', self.table_name), ('phase', self.phase),
+                              ('start', round(self.start, 3)), ('seconds', round(seconds, 6))])
+        if self.blocks:
+            record.update([('rows', self.rows), ('bytes', self.bytes), ('fetch', round(self.fetch, 6)),
+                           ('convert', round(self.convert, 6)), ('copy', round(max(seconds - self.wait, 0), 6))])
+        return record
+
+
+class Metrics(object):
+    """Records the wall time of every phase of every table converted,
+    see :py:data:`PHASES`, along with the :py:data:`COUNTERS` of the data
+    phases, as JSON lines to `path` and as totals per table for
+    :py:meth:`summary`.
+
+    When the conversion runs several pipeline threads or workers, their
+    fetch, convert and copy times overlap and add up to more than the
+    wall time of the phase.
+
+    :Parameters:
+      - `path`: optional file the records are appended to, one JSON object per line
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.f = open(path, 'ab') if path else None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.totals = OrderedDict()
+        self.records = []
+
+    @property
+    def stage(self):
+        """The :py:class:`Stage` running in the current thread, if any"""
+        return getattr(self.local, 'stage', None)
+
+    @contextmanager
+    def phase(self, table_name, phase):
+        """Measures the `phase` of `table_name` run within the block"""
+        stage, previous = Stage(table_name, phase), self.stage
+        self.local.stage = stage
+        try:
+            yield stage
+        finally:
+            self.local.stage = previous
+            self.add(stage.record())
+
+    def add(self, record):
+        """Adds a record, as made by a :py:class:`Stage`, to the totals of its table
+        and writes it out
+        """
+        with self.lock:
+            totals = self.totals.get(record['table'])
+            if totals is None:
+                totals = self.totals[record['table']] = dict.fromkeys(PHASES + COUNTERS, 0)
+            totals[record['phase']] = totals.get(record['phase'], 0) + record['seconds']
+            for counter in COUNTERS:
+                totals[counter] += record.get(counter, 0)
+            self.records.append(record)
+            if self.f:
+                self.f.write(json.dumps(record) + '\n')
+                self.f.flush()
+
+    def pop_records(self):
+        """Returns the records added since the last call, for workers to hand them over"""
+        with self.lock:
+            records, self.records = self.records, []
+        return records
+
+    def summary(self):
+        """Returns the totals of every table as a text table, the step
+        taking the longest in the data phase last
+        """
+        header = ('table', ) + PHASES + COUNTERS + ('slowest', )
+        rows = []
+        for name, totals in self.totals.items():
+            steps = [(totals[step], step) for step in ('fetch', 'convert', 'copy') if totals[step]]
+            rows.append([name] + ['%.2f' % totals[phase] for phase in PHASES] +
+                        [str(totals['rows']), str(totals['bytes'])] +
+                        ['%.2f' % totals[step] for step in ('fetch', 'convert', 'copy')] +
+                        [max(steps)[1] if steps else ''])
+        widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+        return '\n'.join('  '.join(value.ljust(width) if i == 0 else value.rjust(width)
+                                   for i, (value, width) in enumerate(zip(row, widths))).rstrip()
+                         for row in [list(header)] + rows)
+
+    def close(self):
+        if self.f:
+            self.f.close()
+            self.f = None
@@ -1,7 +1,9 @@
 from __future__ import with_statement, absolute_import
 
 import re
+from collections import defaultdict
 from contextlib import closing
+from itertools import chain
 
 import MySQLdb
 import MySQLdb.cursors
@@ -12,6 +14,51 @@ re_column_precision = re.compile(r'\((\d+),(\d+)\)')
 re_key_1 = re.compile(r'CONSTRAINT `(\w+)` FOREIGN KEY \(`(\w+)`\) REFERENCES `(\w+)` \(`(\w+)`\)')
 re_key_2 = re.compile(r'KEY `(\w+)` \((.*)\)')
 re_key_3 = re.compile(r'PRIMARY KEY +\((.*)\)')
+re_variable = re.compile(r'^\w+$')
+re_partition_function = re.compile(r'^\s*(\w+)\s*\(\s*`(\w+)`\s*\)\s*$')
+re_partition_columns = re.compile(r'^\s*`\w+`(\s*,\s*`\w+`)*\s*$')
+
+# partitions of the tables of the database, subpartitions folded into their partition
+PARTITIONS_QUERY = """
+    SELECT TABLE_NAME, PARTITION_NAME, PARTITION_METHOD, PARTITION_EXPRESSION, PARTITION_DESCRIPTION,
+           SUM(TABLE_ROWS)
+    FROM information_schema.PARTITIONS
+    WHERE TABLE_SCHEMA = DATABASE() AND PARTITION_NAME IS NOT NULL %s
+    GROUP BY TABLE_NAME, PARTITION_NAME, PARTITION_METHOD, PARTITION_EXPRESSION, PARTITION_DESCRIPTION,
+             PARTITION_ORDINAL_POSITION
+    ORDER BY TABLE_NAME, PARTITION_ORDINAL_POSITION"""
+
+
+def split_values(description):
+    """Splits the ``PARTITION_DESCRIPTION`` of a partition, its bounds or
+    values, on the commas that aren't within quotes or parentheses.
+    """
+    values, current, depth, quoted = [], '', 0, False
+    for char in description:
+        if char == "'":
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        elif not quoted and not depth and char == ',':
+            values.append(current.strip())
+            current = ''
+            continue
+        current += char
+    values.append(current.strip())
+    return values
+
+
+def key_range_suffix(key_range):
+    """Suffix naming the files of a key range or a partition of a table,
+    see :py:meth:`MysqlReader.key_ranges`, empty for a whole table.
+    """
+    if not key_range:
+        return ''
+    if isinstance(key_range, basestring):
+        return '.%s' % key_range
+    return '.%s-%s' % tuple('' if bound is None else bound for bound in key_range)
 
 
 class DB:
@@ -42,9 +89,23 @@ class DB:
             args['compress'] = options.get('compress', True)
 
         self.options = args
+        self.fetch_size = options.get('fetch_size', None) or 1000
+        self.session_variables = options.get('session_variables', None) or {}
+        for name in self.session_variables:
+            if not re_variable.match(name):
+                raise ValueError('invalid session variable name %r' % name)
 
     def connect(self):
         self.conn = MySQLdb.connect(**self.options)
+        try:
+            # MySQL 8 otherwise serves table statistics, AUTO_INCREMENT included, from a cache
+            with closing(self.conn.cursor()) as cur:
+                cur.execute('SET SESSION information_schema_stats_expiry = 0')
+        except MySQLdb.Error:
+            pass
+        with closing(self.conn.cursor()) as cur:
+            for name, value in sorted(self.session_variables.items()):
+                cur.execute('SET SESSION %s = %%s' % name, (value, ))
 
     def close(self):
         self.conn.close()
@@ -69,25 +130,163 @@ class DB:
             return cur.fetchone()
 
     def query_many(self, sql, args, large):
-        with closing(self.cursor(MySQLdb.cursors.SSCursor if large else MySQLdb.cursors.Cursor)) as cur:
+        if large:
+            return chain.from_iterable(self.query_blocks(sql, args))
+        return self._query_many(sql, args)
+
+    def _query_many(self, sql, args):
+        with closing(self.cursor()) as cur:
             cur.execute(sql, args)
             for row in cur:
                 yield row
 
+    def query_blocks(self, sql, args=(), size=None):
+        """Streams the rows of `sql` from the server in lists of `size`
+        rows, `fetch_size` by default, each fetched in a single call to
+        the driver instead of one call per row.
+        """
+        size = size or self.fetch_size
+        with closing(self.cursor(MySQLdb.cursors.SSCursor)) as cur:
+            cur.execute(sql, args)
+            while True:
+                rows = cur.fetchmany(size)
+                if not rows:
+                    break
+                yield rows
+
+
+class Rows(object):
+    """The rows of a query streamed in blocks, see :py:meth:`DB.query_blocks`.
+    Iterating goes straight to the rows, closing frees the connection
+    when they are not all read.
+    """
+    def __init__(self, blocks):
+        self.blocks = blocks
+
+    def __iter__(self):
+        return chain.from_iterable(self.blocks)
+
+    def close(self):
+        self.blocks.close()
+
 
 class MysqlReader(object):
 
+    class Catalog(object):
+        """Columns, keys, foreign keys, table status and triggers of every
+        table of the database, loaded from ``information_schema`` in a
+        handful of queries instead of several ``SHOW`` queries per table.
+        Rows are kept in the shape of their ``SHOW`` counterparts so that
+        :py:class:`MysqlReader.Table` parses both the same way. Partitions
+        are only loaded when `partitions` is set.
+        """
+        def __init__(self, db, partitions=False):
+            self.db = db
+            self.columns = defaultdict(list)
+            self.status = {}
+            self.indexes = defaultdict(list)
+            self.foreign_keys = defaultdict(list)
+            self.triggers = defaultdict(list)
+            self.partitions = defaultdict(list)
+            self.mariadb = 'mariadb' in db.query('SELECT VERSION()', one=True)[0].lower()
+            self._load_tables()
+            self._load_columns()
+            self._load_indexes()
+            self._load_foreign_keys()
+            self._load_triggers()
+            if partitions:
+                self._load_partitions()
+
+        @property
+        def table_names(self):
+            return sorted(self.status)
+
+        def _load_tables(self):
+            for name, rows, comment, auto_increment in self.db.query("""
+                SELECT TABLE_NAME, TABLE_ROWS, TABLE_COMMENT, AUTO_INCREMENT
+                FROM information_schema.TABLES
+                WHERE TABLE_SCHEMA = DATABASE()"""):
+                self.status[name] = {'rows': rows, 'comment': comment, 'auto_increment': auto_increment}
+
+        def _load_columns(self):
+            for row in self.db.query("""
+                SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, COLLATION_NAME, IS_NULLABLE, COLUMN_KEY,
+                       COLUMN_DEFAULT, EXTRA, PRIVILEGES, COLUMN_COMMENT
+                FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE()
+                ORDER BY TABLE_NAME, ORDINAL_POSITION"""):
+                table_name, row = row[0], list(row[1:])
+                if self.mariadb and row[5] and len(row[5]) > 1 and row[5][0] == row[5][-1] == "'":
+                    # MariaDB quotes literal defaults in information_schema, SHOW COLUMNS doesn't
+                    row[5] = row[5][1:-1].replace("''", "'")
+                self.columns[table_name].append(tuple(row))
+
+        def _load_indexes(self):
+            current = None
+            for table_name, index_name, non_unique, column_name in self.db.query("""
+                SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, COLUMN_NAME
+                FROM information_schema.STATISTICS
+                WHERE TABLE_SCHEMA = DATABASE()
+                ORDER BY TABLE_NAME, INDEX_NAME != 'PRIMARY', NON_UNIQUE, INDEX_NAME, SEQ_IN_INDEX"""):
+                if current != (table_name, index_name):
+                    current = (table_name, index_name)
+                    if index_name == 'PRIMARY':
+                        index = {'primary': True, 'columns': []}
+                    else:
+                        index = {'name': index_name, 'columns': [], 'unique': not int(non_unique)}
+                    self.indexes[table_name].append(index)
+                if column_name is None:
+                    # functional key parts can't be migrated, neither can the index
+                    if index in self.indexes[table_name]:
+                        self.indexes[table_name].remove(index)
+                    continue
+                index['columns'].append(column_name)
+
+        def _load_foreign_keys(self):
+            for table_name, name, column, ref_table, ref_column in self.db.query("""
+                SELECT TABLE_NAME, CONSTRAINT_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME
+                FROM information_schema.KEY_COLUMN_USAGE
+                WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL
+                ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION"""):
+                keys = self.foreign_keys[table_name]
+                if keys and keys[-1]['name'] == name:
+                    # like the SHOW CREATE TABLE parsing, only single column keys are migrated
+                    keys[-1]['multiple'] = True
+                    continue
+                keys.append({
+                    'name': name,
+                    'column': column,
+                    'ref_table': ref_table,
+                    'ref_column': ref_column,
+                    })
+            for table_name, keys in self.foreign_keys.items():
+                self.foreign_keys[table_name] = [k for k in keys if not k.pop('multiple', False)]
+
+        def _load_triggers(self):
+            for row in self.db.query("""
+                SELECT TRIGGER_NAME, EVENT_MANIPULATION, EVENT_OBJECT_TABLE, ACTION_STATEMENT, ACTION_TIMING
+                FROM information_schema.TRIGGERS
+                WHERE TRIGGER_SCHEMA = DATABASE()
+                ORDER BY EVENT_OBJECT_TABLE, ACTION_ORDER"""):
+                self.triggers[row[2]].append(row)
+
+        def _load_partitions(self):
+            for row in self.db.query(PARTITIONS_QUERY % ''):
+                self.partitions[row[0]].append(row[1:])
+
     class Table(object):
+        """A MySQL table. Its definition is only read from the server
+        the first time one of its properties needs it.
+        """
         def __init__(self, reader, name):
             self.reader = reader
             self._name = name
-            self._indexes = []
-            self._foreign_keys = []
-            self._triggers = []
-            self._columns = self._load_columns()
-            self._comment = self._load_table_comment()
-            self._load_indexes()
-            self._load_triggers()
+            self._columns = None
+            self._status = None
+            self._indexes = None
+            self._foreign_keys = None
+            self._triggers = None
+            self._partitioning = None
 
         def _convert_type(self, data_type):
             """Normalize MySQL `data_type`"""
@@ -119,9 +318,18 @@ class MysqlReader(object):
             else:
                 return data_type
 
+        def _is_text(self, field_type):
+            return field_type in ('char', 'varchar', 'tinytext', 'text', 'mediumtext', 'longtext') or \
+                field_type.startswith('enum') or field_type.startswith('set')
+
         def _load_columns(self):
             fields = []
-            for row in self.reader.db.query('SHOW FULL COLUMNS FROM `%s`' % self.name):
+            catalog = self.reader.catalog
+            if catalog:
+                rows = catalog.columns[self.name]
+            else:
+                rows = self.reader.db.query('SHOW FULL COLUMNS FROM `%s`' % self.name)
+            for row in rows:
                 res = ()
                 for field in row:
                   if type(field) == unicode:
@@ -149,21 +357,45 @@ class MysqlReader(object):
                     'select': '`%s`' % name if not field_type.startswith('enum') else
                         'CASE `%(name)s` WHEN "" THEN NULL ELSE `%(name)s` END' % {'name': name},
                     }
+                if not self.reader.use_unicode and self._is_text(field_type):
+                    # served as UTF-8 bytes, whatever the column charset, and left undecoded by MySQLdb
+                    desc['select'] = 'CONVERT(CONVERT(%s USING utf8mb4) USING binary)' % desc['select']
                 fields.append(desc)
 
             for field in (f for f in fields if f['auto_increment']):
-                res = self.reader.db.query('SELECT MAX(`%s`) FROM `%s`;' % (field['name'], self.name), one=True)
-                field['maxval'] = int(res[0]) if res[0] else 0
+                field['maxval'] = self._load_maxval(field)
 
             return fields
 
-        def _load_table_comment(self):
+        def _load_maxval(self, field):
+            """Last value handed out by the auto increment `field`, taken
+            from the table status and only scanned for when unknown.
+            """
+            auto_increment = self.table_status['auto_increment']
+            if auto_increment:
+                return max(int(auto_increment) - 1, 0)
+            res = self.reader.db.query('SELECT MAX(`%s`) FROM `%s`;' % (field['name'], self.name), one=True)
+            return int(res[0]) if res[0] else 0
+
+        def _load_table_status(self):
+            catalog = self.reader.catalog
+            if catalog:
+                return catalog.status[self.name]
             table_status = self.reader.db.query('SHOW TABLE STATUS WHERE Name="%s"' % self.name, one=True)
-            comment = table_status[17]
-            return comment
+            return {
+                'rows': table_status[4],
+                'comment': table_status[17],
+                'auto_increment': table_status[10],
+                }
 
-          
         def _load_indexes(self):
+            self._indexes = []
+            self._foreign_keys = []
+            catalog = self.reader.catalog
+            if catalog:
+                self._indexes.extend(dict(index, columns=list(index['columns'])) for index in catalog.indexes[self.name])
+                self._foreign_keys.extend(dict(key) for key in catalog.foreign_keys[self.name])
+                return
             explain = self.reader.db.query('SHOW CREATE TABLE `%s`' % self.name, one=True)
             explain = explain[1]
             for line in explain.split('\n'):
@@ -193,7 +425,12 @@ class MysqlReader(object):
                     continue
 
         def _load_triggers(self):
-            explain = self.reader.db.query('SHOW TRIGGERS WHERE `table` = \'%s\'' % self.name)
+            self._triggers = []
+            catalog = self.reader.catalog
+            if catalog:
+                explain = catalog.triggers[self.name]
+            else:
+                explain = self.reader.db.query('SHOW TRIGGERS WHERE `table` = \'%s\'' % self.name)
             for row in explain:
                 if type(row) is tuple:
                     trigger = {}
@@ -208,30 +445,133 @@ class MysqlReader(object):
 
                     self._triggers.append(trigger)
 
+        def _load_partitioning(self):
+            if not self.reader.partitions:
+                return {}
+            catalog = self.reader.catalog
+            if catalog:
+                rows = catalog.partitions[self.name]
+            else:
+                rows = [row[1:] for row in self.reader.db.query(PARTITIONS_QUERY % 'AND TABLE_NAME = %s', (self.name, ))]
+            if not rows:
+                return {}
+            method, expression = rows[0][1], rows[0][2] or ''
+            function, columns = None, []
+            match = re_partition_function.match(expression)
+            if match:
+                function, columns = match.group(1).lower(), [match.group(2)]
+            elif re_partition_columns.match(expression):
+                columns = re.findall(r'`(\w+)`', expression)
+            elif expression.strip():
+                # an expression that can't be carried over, the table is created unpartitioned
+                function = expression
+            elif 'KEY' in method:
+                # KEY() partitions on the primary key
+                columns = list(self.primary_key)
+            return {
+                'method': method.replace('LINEAR ', '').replace(' COLUMNS', ''),
+                'function': function,
+                'columns': columns,
+                'partitions': [{
+                    'name': name,
+                    'values': split_values(description) if description is not None else None,
+                    'rows': int(estimate or 0),
+                    } for name, _, _, description, estimate in rows],
+                }
+
+        def load(self):
+            """Reads the whole definition of the table now, instead of the
+            first time each part of it is needed. Returns the table.
+            """
+            for part in (self.columns, self.table_status, self.indexes, self.foreign_keys, self.triggers,
+                         self.partitioning):
+                pass
+            return self
+
         @property
         def name(self):
             return self._name
 
         @property
         def columns(self):
+            if self._columns is None:
+                self._columns = self._load_columns()
             return self._columns
 
+        @property
+        def table_status(self):
+            if self._status is None:
+                self._status = self._load_table_status()
+            return self._status
+
         @property
         def comment(self):
-            return self._comment
+            return self.table_status['comment']
+
+        @property
+        def rows(self):
+            """Estimated number of rows, as reported by ``SHOW TABLE STATUS``"""
+            return int(self.table_status['rows'] or 0)
 
         @property
         def indexes(self):
+            if self._indexes is None:
+                self._load_indexes()
             return self._indexes
 
         @property
         def foreign_keys(self):
+            if self._foreign_keys is None:
+                self._load_indexes()
             return self._foreign_keys
 
         @property
         def triggers(self):
+            if self._triggers is None:
+                self._load_triggers()
             return self._triggers
 
+        @property
+        def partitioning(self):
+            """How the table is partitioned, an empty dict if it isn't: the
+            partitioning `method` (RANGE, LIST, HASH or KEY, their LINEAR
+            and COLUMNS variants included), the `columns` it applies to, the
+            `function` they go through if any, lower cased (e.g. ``year``),
+            and the `partitions`, each with its `name`, its `values` (bounds
+            of RANGE, values of LIST, as SQL literals, None otherwise) and
+            its estimated number of `rows`. Only read with the `partitions`
+            option.
+            """
+            if self._partitioning is None:
+                self._partitioning = self._load_partitioning()
+            return self._partitioning
+
+        @property
+        def partitions(self):
+            """Names of the partitions of the table, empty if it has none"""
+            return [partition['name'] for partition in self.partitioning.get('partitions', [])]
+
+        @property
+        def primary_key(self):
+            """Names of the primary key columns of the table, empty if it has none"""
+            primary = [idx for idx in self.indexes if idx.get('primary', None)]
+            return primary[0]['columns'] if primary else []
+
+        @property
+        def key_column(self):
+            """Name of the single column, integer primary key of the table,
+            None if the table has no such key. Tables with one can be read
+            in key ranges, see :py:meth:`MysqlReader.key_ranges`.
+            """
+            primary = self.primary_key
+            if len(primary) != 1:
+                return None
+            name = primary[0]
+            column = next((c for c in self.columns if c['name'] == name), None)
+            if column and column['type'] in ('tinyint', 'integer', 'bigint', 'numeric'):
+                return name
+            return None
+
         @property
         def query_for(self):
             return 'SELECT %(column_names)s FROM `%(table_name)s`' % {
@@ -239,14 +579,129 @@ class MysqlReader(object):
                 'column_names': ', '. join(c['select'] for c in self.columns)}
 
     def __init__(self, options):
+        self.options = options
         self.db = DB(options)
+        self.lock_db = None
+        self.bulk_introspection = options.get('bulk_introspection', False)
+        self.use_unicode = options.get('use_unicode', True)
+        self.partitions = options.get('partitions', False)
+        self._catalog = None
 
     @property
-    def tables(self):
-        return (self.Table(self, t[0]) for t in self.db.list_tables())
+    def catalog(self):
+        """The :py:class:`Catalog` of the database when `bulk_introspection`
+        is enabled, loaded on first use, None otherwise.
+        """
+        if self.bulk_introspection and self._catalog is None:
+            self._catalog = self.Catalog(self.db, self.partitions)
+        return self._catalog
+
+    @property
+    def table_names(self):
+        if self.catalog:
+            return self.catalog.table_names
+        return [t[0] for t in self.db.list_tables()]
 
-    def read(self, table):
-        return self.db.query(table.query_for, large=True)
+    @property
+    def tables(self):
+        return (self.Table(self, name) for name in self.table_names)
+
+    def key_ranges(self, table, count):
+        """Splits `table` in `count` ranges of its :py:attr:`Table.key_column`.
+
+        Returns a list of `(lower, upper)` tuples, lower bound included and
+        upper bound excluded. The first and last ranges are left open (None)
+        so that together they cover every row of the table. Tables that can't
+        be split get a single `None` range, meaning the whole table.
+
+        Partitioned tables are split in their :py:attr:`Table.partitions`
+        instead, whatever `count`, each range being the name of a partition.
+        """
+        if table.partitions:
+            return table.partitions
+        key = table.key_column
+        if not key or count < 2:
+            return [None]
+        lower, upper = self.db.query('SELECT MIN(`%(key)s`), MAX(`%(key)s`) FROM `%(table)s`' % {
+            'key': key, 'table': table.name}, one=True)
+        if lower is None or upper - lower < count:
+            return [None]
+        step = (upper - lower + 1) // count
+        bounds = [None] + [lower + step * i for i in range(1, count)] + [None]
+        return zip(bounds[:-1], bounds[1:])
+
+    def binlog_position(self):
+        """Current `(log_file, log_pos)` position of the server binlog,
+        None when binary logging is off.
+        """
+        try:
+            row = self.db.query('SHOW BINARY LOG STATUS', one=True)
+        except MySQLdb.Error:
+            # before MySQL 8.2
+            row = self.db.query('SHOW MASTER STATUS', one=True)
+        return (row[0], row[1]) if row else None
+
+    def snapshot(self):
+        """Starts a consistent snapshot transaction on the reader connection,
+        every later read of this reader sees the data as of then.
+        """
+        self.db.query('START TRANSACTION WITH CONSISTENT SNAPSHOT', one=True)
+
+    def lock(self):
+        """Blocks writes to the whole server with a global read lock, held by
+        a connection of its own until :py:meth:`unlock`. Snapshots started by
+        any connection in between see the very same data, and the binlog
+        position doesn't move.
+        """
+        self.lock_db = DB(self.options)
+        self.lock_db.query('FLUSH TABLES WITH READ LOCK', one=True)
+
+    def unlock(self):
+        """Releases the lock taken by :py:meth:`lock`"""
+        if self.lock_db:
+            self.lock_db.query('UNLOCK TABLES', one=True)
+            self.lock_db.close()
+            self.lock_db = None
+
+    def watermark(self, table, column):
+        """Highest value of `column` in `table`, None when it is empty"""
+        return self.db.query('SELECT MAX(`%s`) FROM `%s`' % (column, table.name), one=True)[0]
+
+    def read(self, table, key_range=None, since=None):
+        """Reads the rows of `table`.
+
+        :Parameters:
+          - `key_range`: optional `(lower, upper)` range of the table key, or partition name, to restrict the read to, see :py:meth:`key_ranges`
+          - `since`: optional `(column, value)` watermark, only the rows whose `column` is at or past `value` are read
+
+        Returns a :py:class:`Rows` iterable, to be closed when not read to the end.
+        """
+        return Rows(self.read_blocks(table, key_range, since))
+
+    def read_blocks(self, table, key_range=None, since=None, size=None):
+        """Reads the rows of `table` in lists of `size` rows, the
+        `fetch_size` option by default, see :py:meth:`read`.
+        """
+        sql, args = table.query_for, []
+        if isinstance(key_range, basestring):
+            sql, key_range = '%s PARTITION (`%s`)' % (sql, key_range), None
+        where = []
+        if since:
+            column, value = since
+            where.append('`%s` >= %%s' % column)
+            args.append(value)
+        if key_range:
+            lower, upper = key_range
+            if lower is not None:
+                where.append('`%s` >= %%s' % table.key_column)
+                args.append(lower)
+            if upper is not None:
+                where.append('`%s` < %%s' % table.key_column)
+                args.append(upper)
+        if where:
+            sql = '%s WHERE %s' % (sql, ' AND '.join(where))
+        return self.db.query_blocks(sql, args, size)
 
     def close(self):
+        self.unlock()
         self.db.close()
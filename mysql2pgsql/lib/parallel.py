@@ -0,0 +1,121 @@
+from __future__ import absolute_import
+
+import os
+
+from .checkpoint import Checkpoint
+from .errors import GeneralException
+from .metrics import Metrics
+from .profiler import Profiler
+from .mysql_reader import MysqlReader
+from .postgres_db_writer import PostgresDbWriter
+from .postgres_directory_writer import PostgresDirectoryWriter
+
+# Every process of the pool gets its own reader and writer, hence its
+# own MySQL and PostgreSQL connections, see :py:func:`init_worker`.
+_reader = None
+_writer = None
+_tables = {}
+# set in a worker the pool started to replace one that died, once the
+# snapshot of the others was taken: it can't read the same data
+_respawned = False
+
+
+def init_worker(file_options, ready=None, started=None):
+    """Pool initializer, opens the connections used by this worker
+    for all the tables it will be handed.
+
+    :Parameters:
+      - `file_options`: the configuration file options, as used by :py:class:`mysql2pgsql.lib.converter.Converter`
+      - `ready`: optional :py:class:`multiprocessing.Queue`. When given, the worker reads within a consistent snapshot and reports on it once that snapshot is started, see :py:meth:`mysql2pgsql.lib.mysql_reader.MysqlReader.lock`
+      - `started`: the :py:class:`multiprocessing.Event` set once every worker reported on `ready`. A worker started after that replaces one that died, its :py:func:`write_contents` fails
+    """
+    global _reader, _writer, _respawned
+    _reader = MysqlReader(file_options['mysql'])
+    if ready is not None:
+        if started.is_set():
+            _respawned = True
+            return
+        _reader.snapshot()
+        ready.put(os.getpid())
+    _writer = open_writer(file_options)
+    if file_options.get('checkpoint') and isinstance(_writer, PostgresDbWriter):
+        _writer.checkpoint = Checkpoint(_writer)
+    if file_options.get('metrics'):
+        # records are handed back to the parent, which writes them out
+        _writer.metrics = Metrics()
+    if file_options.get('profile'):
+        _writer.profiler = Profiler(file_options['profile'])
+
+
+def open_writer(file_options, pool=None):
+    """Opens a new writer to the destination of the configuration
+    `file_options`: a :py:class:`PostgresDbWriter` with its own connection,
+    or one of `pool` when given, or a :py:class:`PostgresDirectoryWriter`
+    of data files only when dumping to a directory.
+    """
+    destination = file_options['destination']
+    if destination.get('directory', None):
+        return PostgresDirectoryWriter(destination['directory'],
+                                       compression=destination.get('compression', None),
+                                       data_only=True,
+                                       index_prefix=file_options.get('index_prefix'),
+                                       tz=file_options.get('timezone'),
+                                       batch_size=file_options.get('batch_size'),
+                                       pipeline=file_options.get('pipeline'))
+    return PostgresDbWriter(destination['postgres'],
+                            pool=pool,
+                            index_prefix=file_options.get('index_prefix'),
+                            tz=file_options.get('timezone'),
+                            batch_size=file_options.get('batch_size'),
+                            pipeline=file_options.get('pipeline'))
+
+
+def write_contents(unit):
+    """Copies one unit of work, a `(table_name, key_range)` tuple as
+    built by :py:func:`work_units`, using the connections of the current
+    worker. Returns `(table_name, key_range, result, records)` once done,
+    `result` being what the `write_contents` of the writer returned and
+    `records` the :py:mod:`mysql2pgsql.lib.metrics` records of the copy.
+    """
+    if _respawned:
+        raise GeneralException('a worker died after the consistent snapshot was taken, '
+                               'the worker replacing it cannot read the same data')
+    table_name, key_range = unit
+    table = _tables.get(table_name)
+    if table is None:
+        table = _tables[table_name] = MysqlReader.Table(_reader, table_name)
+    result = _writer.write_contents(table, _reader, key_range)
+    return table_name, key_range, result, _writer.metrics.pop_records() if _writer.metrics else []
+
+
+def key_ranges(table, reader, chunks=1, checkpoint=None):
+    """Returns `(ranges, pending)`, the key ranges `table` is copied in
+    and those of them that are still to be copied.
+
+    Partitioned tables are copied partition by partition, tables with an
+    integer primary key are cut in `chunks` key ranges, the others are
+    copied in one go. With a `checkpoint`, the ranges planned by
+    a previous run are reused and the ones it committed are left out.
+    """
+    ranges = checkpoint.plan(table.name) if checkpoint else None
+    if ranges is None:
+        ranges = reader.key_ranges(table, chunks)
+        if checkpoint:
+            checkpoint.record_plan(table.name, ranges)
+    return ranges, checkpoint.pending(table.name, ranges) if checkpoint else ranges
+
+
+def work_units(tables, reader, chunks=1, checkpoint=None):
+    """Splits the data load of `tables` in `(table_name, key_range)` units,
+    see :py:func:`key_ranges`, so that several workers can copy a table at
+    once. Units are ordered by their estimated row count, biggest first,
+    so the longest loads start early and the pool drains evenly.
+    """
+    units = []
+    for table in tables:
+        ranges, pending = key_ranges(table, reader, chunks, checkpoint)
+        partition_rows = dict((p['name'], p['rows']) for p in table.partitioning.get('partitions', []))
+        units.extend((partition_rows.get(key_range, table.rows / float(len(ranges))), (table.name, key_range))
+                     for key_range in pending)
+    units.sort(key=lambda u: u[0], reverse=True)
+    return [unit for _, unit in units]
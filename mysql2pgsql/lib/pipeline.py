@@ -0,0 +1,105 @@
+from __future__ import absolute_import
+
+import sys
+import threading
+from itertools import chain, imap
+from Queue import Empty, Full, Queue
+
+# rows per block handed from a stage to the next, when not converting in batches
+BLOCK_SIZE = 1000
+
+# blocks a stage may run ahead of the next one
+DEPTH = 4
+
+_DONE = object()
+
+
+def threaded(iterable, depth=DEPTH):
+    """Iterates `iterable` in a thread of its own, at most `depth` items
+    ahead of the caller, and yields its items in order. An exception
+    raised by `iterable` is raised to the caller once it gets there.
+
+    Closing the returned generator stops the thread and waits for it, so
+    that whatever connection `iterable` reads from is free again.
+    """
+    queue = Queue(depth)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        queue.put((item, None), timeout=0.1)
+                        break
+                    except Full:
+                        pass
+                if stop.is_set():
+                    return
+            queue.put((_DONE, None))
+        except:
+            queue.put((_DONE, sys.exc_info()))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            try:
+                # waiting with a timeout leaves the main thread interruptible
+                item, error = queue.get(timeout=1)
+            except Empty:
+                continue
+            if item is _DONE:
+                if error:
+                    raise error[0], error[1], error[2]
+                return
+            yield item
+    finally:
+        stop.set()
+        while thread.is_alive():
+            try:
+                queue.get(timeout=0.1)
+            except Empty:
+                pass
+        thread.join()
+
+
+def pipelined(blocks, encode, depth=DEPTH):
+    """Returns an iterator of the blocks of lines `encode` turns `blocks`
+    of rows into, reading `blocks` and encoding them each in a thread of
+    their own, so that neither waits for the other nor for the caller
+    sending the lines on.
+
+    Closing the returned generator stops both threads, see :py:func:`threaded`.
+
+    :Parameters:
+      - `blocks`: iterable of the lists of rows to encode, read from MySQL
+      - `encode`: callable returning the list of lines of a list of rows
+      - `depth`: blocks each stage may run ahead of the next one
+    """
+    reading = threaded(blocks, depth)
+    encoding = threaded(imap(encode, reading), depth)
+    try:
+        for lines in encoding:
+            yield lines
+    finally:
+        # the encoding thread is done with the reading stage once stopped
+        encoding.close()
+        reading.close()
+
+
+def flatten(blocks, *sources):
+    """Iterates the items of `blocks`, closing the `sources` they come
+    from, in order, once they are all read or the returned generator is
+    closed: the :py:func:`pipelined` generator first, so that its threads
+    are stopped, then the rows it read.
+    """
+    try:
+        for item in chain.from_iterable(blocks):
+            yield item
+    finally:
+        for source in sources:
+            close = getattr(source, 'close', None)
+            if close:
+                close()
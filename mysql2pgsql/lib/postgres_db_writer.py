@@ -1,13 +1,88 @@
 from __future__ import with_statement, absolute_import
 
+import threading
 import time
 from contextlib import closing
+from itertools import imap
 
 import psycopg2
 
-from . import print_row_progress, status_logger
+from . import binary_copy, print_row_progress, status_logger
 from .postgres_writer import PostgresWriter
 
+# how table data is loaded, see the load_strategy option
+LOAD_STRATEGIES = ('logged', 'unlogged', 'truncate')
+
+
+class ConnectionPool(object):
+    """Hands out connections to the PostgreSQL server of `db_options`,
+    set up for the writers, and keeps up to `size` of the ones given
+    back open for the next writer. Writers of threads working at once,
+    such as index or restore workers, share one so that connections
+    and their setup outlive each of them.
+
+    :Parameters:
+      - `db_options`: :py:obj:`dict` containing connection specific variables, see :py:class:`PostgresDbWriter`
+      - `size`: number of idle connections kept open, `pool_size` of `db_options` by default
+    """
+    def __init__(self, db_options, size=None):
+        self.connect_options = {
+            'host': str(db_options['hostname']),
+            'port': db_options.get('port', 5432),
+            'database': str(db_options['database']),
+            'password': str(db_options.get('password', None)) or '',
+            'user': str(db_options['username']),
+            }
+        if ':' in str(db_options['database']):
+            self.connect_options['database'], self.schema = self.connect_options['database'].split(':')
+        else:
+            self.schema = None
+        self.maintenance_work_mem = db_options.get('maintenance_work_mem', None)
+        self.size = (db_options.get('pool_size', None) or 1) if size is None else size
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """Opens a new connection with the session settings of the writers"""
+        conn = psycopg2.connect(**self.connect_options)
+        with closing(conn.cursor()) as cur:
+            if self.schema:
+                cur.execute('SET search_path TO %s' % self.schema)
+            cur.execute('SET client_encoding = \'UTF8\'')
+            if conn.server_version >= 80200:
+                cur.execute('SET standard_conforming_strings = off')
+            cur.execute('SET check_function_bodies = false')
+            cur.execute('SET client_min_messages = warning')
+            if self.maintenance_work_mem:
+                cur.execute('SET maintenance_work_mem = %s', (str(self.maintenance_work_mem), ))
+        conn.commit()
+        return conn
+
+    def getconn(self):
+        """Returns an idle connection, or a new one when there is none"""
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return self.connect()
+
+    def putconn(self, conn):
+        """Gives `conn` back, rolling back whatever it left uncommitted.
+        It is closed when `size` connections are idle already.
+        """
+        if not conn.closed:
+            conn.rollback()
+            with self.lock:
+                if len(self.idle) < self.size:
+                    self.idle.append(conn)
+                    return
+            conn.close()
+
+    def closeall(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
 
 class PostgresDbWriter(PostgresWriter):
     """Class used to stream DDL and/or data
@@ -16,6 +91,7 @@ class PostgresDbWriter(PostgresWriter):
     :Parameters:
       - `db_options`: :py:obj:`dict` containing connection specific variables
       - `verbose`: whether or not to log progress to :py:obj:`stdout`
+      - `pool`: optional :py:class:`ConnectionPool` the connection is taken from and given back to, one of its own by default
 
     """
     class FileObjFaker(object):
@@ -25,76 +101,106 @@ class PostgresDbWriter(PostgresWriter):
         :Parameters:
           - `table`: an instance of a :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader.Table` object that represents the table to read/write.
           - `data`:
-          - `processor`:
+          - `encoder`: callable returning the copy line of a row, see :py:meth:`mysql2pgsql.lib.postgres_writer.PostgresWriter.row_encoder`. None when `data` are copy lines already
           - `verbose`: whether or not to log progress to :py:obj:`stdout`
+          - `size`: number of characters returned by :py:meth:`read` when called without a size
+          - `header`: data sent before the first row
+          - `trailer`: data sent after the last row
         """
-        def __init__(self, table, data, processor, verbose=False):
+        def __init__(self, table, data, encoder, verbose=False, size=256 * 1024, header='', trailer=''):
             self.data = iter(data)
             self.table = table
-            self.processor = processor
+            self.encoder = encoder
             self.verbose = verbose
+            self.size = size
+            self.header = header
+            self.trailer = trailer
 
             if verbose:
-                self.idx = 1
+                self.idx = 0
                 self.start_time = time.time()
                 self.prev_val_len = 0
                 self.prev_idx = 0
 
         def readline(self, *args, **kwargs):
             try:
-                row = list(self.data.next())
+                row = self.data.next()
             except StopIteration:
-                if self.verbose:
-                    print('')
-                return ''
-            else:
-                self.processor(self.table, row)
-                try:
-                    return '%s\n' % ('\t'.join(row))
-                except UnicodeDecodeError:
-                    return '%s\n' % ('\t'.join(r.decode('utf8') for r in row))
-            finally:
-                if self.verbose:
-                    if (self.idx % 20000) == 0:
-                        now = time.time()
-                        elapsed = now - self.start_time
-                        val = '%.2f rows/sec [%s] ' % ((self.idx - self.prev_idx) / elapsed, self.idx)
-                        print_row_progress('%s%s' % (("\b" * self.prev_val_len), val)),
-                        self.prev_val_len = len(val) + 3
-                        self.start_time = now
-                        self.prev_idx = self.idx + 0
-                    self.idx += 1
-
-        def read(self, *args, **kwargs):
-            return self.readline(*args, **kwargs)
+                return self._done()
+            if self.verbose:
+                self._progress(1)
+            return self.encoder(row) if self.encoder else row
+
+        def read(self, size=-1):
+            """Returns as many encoded rows as fit in `size` characters
+            (the row crossing that limit included), or an empty string
+            once the data is exhausted.
+            """
+            if size is None or size < 0:
+                size = self.size
+            encode = self.encoder
+            lines = [self.header] if self.header else []
+            length = len(self.header)
+            self.header = ''
+            offset = len(lines)
+            for line in (imap(encode, self.data) if encode else self.data):
+                lines.append(line)
+                length += len(line)
+                if length >= size:
+                    break
+            if not lines:
+                return self._done()
+            if self.verbose:
+                self._progress(len(lines) - offset)
+            try:
+                return ''.join(lines)
+            except UnicodeDecodeError:
+                return u''.join(l.decode('utf8') if isinstance(l, str) else l for l in lines)
+
+        def close(self):
+            """Closes `data` when it can be, stopping the pipeline threads it may come from"""
+            close = getattr(self.data, 'close', None)
+            if close:
+                close()
+
+        def _done(self):
+            trailer, self.trailer = self.trailer, ''
+            if self.verbose and not trailer:
+                print('')
+            return trailer
+
+        def _progress(self, count):
+            self.idx += count
+            if self.idx // 20000 > self.prev_idx // 20000:
+                now = time.time()
+                elapsed = now - self.start_time
+                val = '%.2f rows/sec [%s] ' % ((self.idx - self.prev_idx) / elapsed, self.idx)
+                print_row_progress('%s%s' % (("\b" * self.prev_val_len), val)),
+                self.prev_val_len = len(val) + 3
+                self.start_time = now
+                self.prev_idx = self.idx
+
+    copy_buffer_size = 256 * 1024
 
     def __init__(self, db_options, verbose=False, *args, **kwargs):
+        pool = kwargs.pop('pool', None)
         super(PostgresDbWriter, self).__init__(*args, **kwargs)
         self.verbose = verbose
-        self.db_options = {
-            'host': str(db_options['hostname']),
-            'port': db_options.get('port', 5432),
-            'database': str(db_options['database']),
-            'password': str(db_options.get('password', None)) or '',
-            'user': str(db_options['username']),
-            }
-        if ':' in str(db_options['database']):
-            self.db_options['database'], self.schema = self.db_options['database'].split(':')
-        else:
-            self.schema = None
+        self.copy_format = db_options.get('copy_format', None) or 'text'
+        self.load_strategy = db_options.get('load_strategy', None) or 'logged'
+        if self.load_strategy not in LOAD_STRATEGIES:
+            raise ValueError('unknown load_strategy %s' % self.load_strategy)
+        self.unlogged = self.load_strategy == 'unlogged'
+        self.checkpoint = None
+        # the pool a writer opened itself is closed along with it
+        self.own_pool = pool is None
+        self.pool = pool or ConnectionPool(db_options)
+        self.schema = self.pool.schema
 
         self.open()
 
     def open(self):
-        self.conn = psycopg2.connect(**self.db_options)
-        with closing(self.conn.cursor()) as cur:
-            if self.schema:
-                cur.execute('SET search_path TO %s' % self.schema)
-            cur.execute('SET client_encoding = \'UTF8\'')
-            if self.conn.server_version >= 80200:
-                cur.execute('SET standard_conforming_strings = off')
-            cur.execute('SET check_function_bodies = false')
-            cur.execute('SET client_min_messages = warning')
+        self.conn = self.pool.getconn()
 
     def query(self, sql, args=(), one=False):
         with closing(self.conn.cursor()) as cur:
@@ -102,25 +208,55 @@ class PostgresDbWriter(PostgresWriter):
             return cur.fetchone() if one else cur
 
     def execute(self, sql, args=(), many=False):
-        with closing(self.conn.cursor()) as cur:
-            if many:
-                cur.executemany(sql, args)
-            else:
-                cur.execute(sql, args)
+        """Runs `sql` with `args`, once per item of `args` when `many`, and
+        commits. `sql` may also be a list of statements without arguments,
+        which are sent at once and committed together, or not at all.
+        """
+        try:
+            with closing(self.conn.cursor()) as cur:
+                if isinstance(sql, list):
+                    cur.execute(u'\n'.join(s.decode('utf8') if isinstance(s, str) else s for s in sql))
+                elif many:
+                    cur.executemany(sql, args)
+                else:
+                    cur.execute(sql, args)
             self.conn.commit()
+        except:
+            self.conn.rollback()
+            raise
 
-    def copy_from(self, file_obj, table_name, columns):
+    def copy_from(self, file_obj, table_name, columns, before_commit=None):
         with closing(self.conn.cursor()) as cur:
             cur.copy_from(file_obj,
                           table=table_name,
-                          columns=columns
+                          columns=columns,
+                          size=self.copy_buffer_size
                           )
+            if before_commit:
+                before_commit(cur)
+
+        self.conn.commit()
+
+    def copy_binary(self, file_obj, table_name, columns, before_commit=None):
+        self.copy_expert('COPY %s (%s) FROM STDIN WITH BINARY' % (table_name, ', '.join(columns)),
+                         file_obj, before_commit)
+
+    def copy_expert(self, sql, file_obj, before_commit=None):
+        """Runs the ``COPY ... FROM STDIN`` statement `sql` with the data of `file_obj`"""
+        with closing(self.conn.cursor()) as cur:
+            cur.copy_expert(sql, file_obj, size=self.copy_buffer_size)
+            if before_commit:
+                before_commit(cur)
 
         self.conn.commit()
 
     def close(self):
-        """Closes connection to the PostgreSQL server"""
-        self.conn.close()
+        """Gives the connection back to the pool, closing the pool too when
+        the writer opened it
+        """
+        self.pool.putconn(self.conn)
+        if self.own_pool:
+            self.pool.closeall()
 
     def exists(self, relname):
         rc = self.query('SELECT COUNT(!) FROM pg_class WHERE relname = %s', (relname, ), one=True)
@@ -128,7 +264,7 @@ class PostgresDbWriter(PostgresWriter):
 
     @status_logger
     def truncate(self, table):
-        """Send DDL to truncate the specified `table`
+        """Send DDL to truncate the specified `table`, in one transaction
 
         :Parameters:
           - `table`: an instance of a :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader.Table` object that represents the table to read/write.
@@ -136,13 +272,11 @@ class PostgresDbWriter(PostgresWriter):
         Returns None
         """
         truncate_sql, serial_key_sql = super(PostgresDbWriter, self).truncate(table)
-        self.execute(truncate_sql)
-        if serial_key_sql:
-            self.execute(serial_key_sql)
+        self.execute([truncate_sql] + ([serial_key_sql] if serial_key_sql else []))
 
     @status_logger
     def write_table(self, table):
-        """Send DDL to create the specified `table`
+        """Send DDL to create the specified `table`, in one transaction
 
         :Parameters:
           - `table`: an instance of a :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader.Table` object that represents the table to read/write.
@@ -150,12 +284,11 @@ class PostgresDbWriter(PostgresWriter):
         Returns None
         """
         table_sql, serial_key_sql = super(PostgresDbWriter, self).write_table(table)
-        for sql in serial_key_sql + table_sql:
-            self.execute(sql)
+        self.execute(serial_key_sql + table_sql)
 
     @status_logger
     def write_indexes(self, table):
-        """Send DDL to create the specified `table` indexes
+        """Send DDL to create the specified `table` indexes, in one transaction
 
         :Parameters:
           - `table`: an instance of a :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader.Table` object that represents the table to read/write.
@@ -163,12 +296,12 @@ class PostgresDbWriter(PostgresWriter):
         Returns None
         """
         index_sql = super(PostgresDbWriter, self).write_indexes(table)
-        for sql in index_sql:
-            self.execute(sql)
+        if index_sql:
+            self.execute(index_sql)
 
     @status_logger
     def write_triggers(self, table):
-        """Send DDL to create the specified `table` triggers
+        """Send DDL to create the specified `table` triggers, in one transaction
 
         :Parameters:
           - `table`: an instance of a :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader.Table` object that represents the table to read/write.
@@ -176,12 +309,24 @@ class PostgresDbWriter(PostgresWriter):
         Returns None
         """
         index_sql = super(PostgresDbWriter, self).write_triggers(table)
-        for sql in index_sql:
-            self.execute(sql)
+        if index_sql:
+            self.execute(index_sql)
+
+    @status_logger
+    def set_logged(self, table):
+        """Switch the specified `table`, created UNLOGGED, to LOGGED. The
+        table and its indexes are rewritten to the WAL in one go.
+
+        :Parameters:
+          - `table`: an instance of a :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader.Table` object that represents the table to read/write.
+
+        Returns None
+        """
+        self.execute(super(PostgresDbWriter, self).set_logged(table))
 
     @status_logger
     def write_constraints(self, table):
-        """Send DDL to create the specified `table` constraints
+        """Send DDL to create the specified `table` constraints, in one transaction
 
         :Parameters:
           - `table`: an instance of a :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader.Table` object that represents the table to read/write.
@@ -189,18 +334,98 @@ class PostgresDbWriter(PostgresWriter):
         Returns None
         """
         constraint_sql = super(PostgresDbWriter, self).write_constraints(table)
-        for sql in constraint_sql:
-            self.execute(sql)
+        if constraint_sql:
+            self.execute(constraint_sql)
 
     @status_logger
-    def write_contents(self, table, reader):
+    def write_contents(self, table, reader, key_range=None):
         """Write the contents of `table`
 
         :Parameters:
           - `table`: an instance of a :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader.Table` object that represents the table to read/write.
           - `reader`: an instance of a :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader` object that allows reading from the data source.
+          - `key_range`: optional `(lower, upper)` range of the table key, or partition name, to restrict the copy to, see :py:meth:`mysql2pgsql.lib.mysql_reader.MysqlReader.key_ranges`.
+
+        When a :py:class:`mysql2pgsql.lib.checkpoint.Checkpoint` is set, the
+        copied range is journaled in the same transaction as the copy. With
+        the `truncate` load strategy, a table copied whole is emptied in
+        that transaction too, which lets a server with ``wal_level = minimal``
+        skip writing the copied data to the WAL.
+
+        Returns None
+        """
+        before_commit = None
+        if self.checkpoint:
+            before_commit = lambda cur: self.checkpoint.record(table.name, 'chunk', key_range, cur)
+        if self.load_strategy == 'truncate' and not key_range:
+            with closing(self.conn.cursor()) as cur:
+                cur.execute('TRUNCATE "%s"' % table.name)
+        self.copy_rows(table, reader.read(table, key_range), '"%s"' % table.name, before_commit)
+
+    @status_logger
+    def sync_contents(self, table, reader, since=None, before_commit=None):
+        """Brings the rows of `table` up to date, without recreating it.
+
+        The rows read are copied to a temporary staging table and upserted
+        from there on the primary key, all in one transaction. Tables without
+        a primary key have all their rows replaced instead.
+
+        :Parameters:
+          - `table`: an instance of a :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader.Table` object that represents the table to read/write.
+          - `reader`: an instance of a :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader` object that allows reading from the data source.
+          - `since`: optional `(column, value)` watermark, only the rows from it on are read, see :py:meth:`mysql2pgsql.lib.mysql_reader.MysqlReader.read`.
+          - `before_commit`: optional callable, run with the cursor of the transaction before it is committed.
 
         Returns None
         """
-        f = self.FileObjFaker(table, reader.read(table), self.process_row, self.verbose)
-        self.copy_from(f, '"%s"' % table.name, ['"%s"' % c['name'] for c in table.columns])
+        if not table.primary_key:
+            with closing(self.conn.cursor()) as cur:
+                cur.execute('DELETE FROM "%s"' % table.name)
+            self.copy_rows(table, reader.read(table), '"%s"' % table.name, before_commit)
+        else:
+            self.upsert_rows(table, reader.read(table, since=since), before_commit=before_commit)
+
+    def upsert_rows(self, table, rows, deleted=(), before_commit=None):
+        """Inserts `rows` of `table`, read from MySQL, replacing the ones
+        already there with the same primary key, and deletes the rows whose
+        primary key is in `deleted`, all in one transaction.
+
+        :Parameters:
+          - `table`: an instance of a :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader.Table` object that has a primary key.
+          - `rows`: iterable of rows, as read by :py:meth:`mysql2pgsql.lib.mysql_reader.MysqlReader.read`.
+          - `deleted`: primary keys, as tuples of values in :py:attr:`mysql2pgsql.lib.mysql_reader.MysqlReader.Table.primary_key` order.
+          - `before_commit`: optional callable, run with the cursor of the transaction before it is committed.
+
+        Returns None
+        """
+        staging = '"mysql2pgsql_staging_%s"' % table.name
+        keys = ', '.join('"%s"' % c for c in table.primary_key)
+        columns = ', '.join('"%s"' % c['name'] for c in table.columns)
+        updates = ', '.join('"%(name)s" = EXCLUDED."%(name)s"' % c for c in table.columns
+                            if c['name'] not in table.primary_key)
+
+        def merge(cur):
+            cur.execute('INSERT INTO "%s" (%s) SELECT %s FROM %s ON CONFLICT (%s) DO %s' % (
+                table.name, columns, columns, staging, keys, 'UPDATE SET %s' % updates if updates else 'NOTHING'))
+            if before_commit:
+                before_commit(cur)
+
+        with closing(self.conn.cursor()) as cur:
+            if deleted:
+                cur.execute('DELETE FROM "%s" WHERE (%s) IN %%s' % (table.name, keys), (tuple(deleted), ))
+            cur.execute('CREATE TEMPORARY TABLE %s (LIKE "%s") ON COMMIT DROP' % (staging, table.name))
+        self.copy_rows(table, rows, staging, merge)
+
+    def copy_rows(self, table, rows, table_name, before_commit=None):
+        """Copies `rows` of `table` to `table_name`, in the configured `copy_format`"""
+        columns = ['"%s"' % c['name'] for c in table.columns]
+        if self.copy_format == 'binary':
+            f = self.FileObjFaker(table, self.encode_rows(table, rows, binary_copy.row_encoder(self, table)), None,
+                                  self.verbose, self.copy_buffer_size, binary_copy.HEADER, binary_copy.TRAILER)
+            with closing(f):
+                self.copy_binary(f, table_name, columns, before_commit)
+        else:
+            f = self.FileObjFaker(table, self.encode_rows(table, rows), None,
+                                  self.verbose, self.copy_buffer_size)
+            with closing(f):
+                self.copy_from(f, table_name, columns, before_commit)
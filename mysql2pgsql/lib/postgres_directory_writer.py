@@ -0,0 +1,226 @@
+from __future__ import with_statement, absolute_import
+
+import codecs
+import gzip
+import json
+import os
+from collections import OrderedDict
+from contextlib import closing
+
+from . import print_red, status_logger
+from .postgres_db_writer import PostgresDbWriter
+from .postgres_file_writer import PostgresFileWriter
+from .mysql_reader import key_range_suffix
+from .postgres_writer import PostgresWriter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+SCHEMA_FILE = 'schema.sql'
+POST_DATA_FILE = 'post-data.sql'
+MANIFEST_FILE = 'manifest.json'
+DATA_DIRECTORY = 'data'
+
+# session settings heading every data file, so that psql replays it as is
+DATA_PREAMBLE = "SET client_encoding = 'UTF8';\n"
+
+EXTENSIONS = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+    'lz4': '.lz4',
+    'none': '',
+    }
+
+
+def available_compression(compression):
+    """Returns `compression` when it can be used, falling back to gzip
+    when the package it needs isn't installed.
+    """
+    compression = compression or 'gzip'
+    if compression not in EXTENSIONS:
+        raise ValueError('unknown compression %s' % compression)
+    if compression == 'zstd' and zstandard is None or compression == 'lz4' and lz4 is None:
+        print_red('%s compression needs the %s package, using gzip' % (
+            compression, 'zstandard' if compression == 'zstd' else 'lz4'))
+        return 'gzip'
+    return compression
+
+
+def open_compressed(path, compression, mode='wb'):
+    """Opens the file at `path` compressed with `compression`, see :py:data:`EXTENSIONS`"""
+    if compression == 'gzip':
+        # the default level 9 costs several times the time of 6 for a few percent
+        return gzip.open(path, mode, 6) if 'w' in mode else gzip.open(path, mode)
+    elif compression == 'zstd':
+        f = open(path, mode)
+        if 'w' in mode:
+            return zstandard.ZstdCompressor().stream_writer(f)
+        return zstandard.ZstdDecompressor().stream_reader(f)
+    elif compression == 'lz4':
+        return lz4.frame.open(path, mode)
+    return open(path, mode)
+
+
+class PostgresDirectoryWriter(PostgresFileWriter):
+    """Class used to dump the PostgreSQL DDL and data of a MySQL
+    server to a directory, so that it can be restored in parallel.
+
+    The directory holds:
+
+      - ``schema.sql``: the DDL creating the tables
+      - ``data/``: one compressed file of ``COPY`` data per table, or per
+        key range of a table when loaded in chunks
+      - ``post-data.sql``: the DDL of indexes, constraints and triggers
+      - ``manifest.json``: the list of the data files and post-data
+        statements of each table, see :py:mod:`mysql2pgsql.lib.restore`
+
+    Every data file is a complete ``COPY ... FROM stdin`` statement, so
+    it can be restored with ``psql`` as well.
+
+    :Parameters:
+      - `path`: the directory to write to, created if needed
+      - `verbose`: whether or not to log progress to :py:obj:`stdout`
+      - `compression`: 'gzip', 'zstd', 'lz4' or 'none'
+      - `data_only`: whether only data files are written, as done by the workers of a parallel dump
+    """
+    def __init__(self, path, verbose=False, compression='gzip', data_only=False, *args, **kwargs):
+        self.path = path
+        self.compression = available_compression(compression)
+        self.data_only = data_only
+        self.tables = OrderedDict()
+        data_path = os.path.join(path, DATA_DIRECTORY)
+        if not os.path.isdir(data_path):
+            try:
+                os.makedirs(data_path)
+            except OSError:
+                # created meanwhile by another worker
+                if not os.path.isdir(data_path):
+                    raise
+        if data_only:
+            PostgresWriter.__init__(self, *args, **kwargs)
+            self.verbose = verbose
+            self.f = self.post_data = None
+        else:
+            super(PostgresDirectoryWriter, self).__init__(codecs.open(os.path.join(path, SCHEMA_FILE), 'wb', 'utf-8'),
+                                                          verbose, *args, **kwargs)
+            self.post_data = codecs.open(os.path.join(path, POST_DATA_FILE), 'wb', 'utf-8')
+
+    def table_entry(self, table_name):
+        entry = self.tables.get(table_name)
+        if entry is None:
+            entry = self.tables[table_name] = OrderedDict([
+                ('name', table_name),
+                ('data', []),
+                ('primary_key', []),
+                ('indexes', []),
+                ('constraints', []),
+                ('references', []),
+                ('triggers', [])])
+        return entry
+
+    def write_post_data(self, table, kind, statements):
+        if statements:
+            self.post_data.write('\n-- %s of %s\n%s\n' % (kind.capitalize(), table.name, '\n'.join(statements)))
+
+    @status_logger
+    def write_indexes(self, table):
+        """Write DDL of `table` indexes to the post-data file and manifest
+
+        :Parameters:
+          - `table`: an instance of a :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader.Table` object that represents the table to read/write.
+
+        Returns None
+        """
+        primary_sql, index_sql = self.index_statements(table)
+        entry = self.table_entry(table.name)
+        entry['primary_key'] = primary_sql
+        entry['indexes'] = index_sql
+        self.write_post_data(table, 'indexes', primary_sql + [sql for statements in index_sql for sql in statements])
+
+    @status_logger
+    def write_constraints(self, table):
+        """Write DDL of `table` constraints to the post-data file and manifest
+
+        :Parameters:
+          - `table`: an instance of a :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader.Table` object that represents the table to read/write.
+
+        Returns None
+        """
+        entry = self.table_entry(table.name)
+        entry['constraints'] = PostgresWriter.write_constraints(self, table)
+        entry['references'] = sorted(set(key['ref_table'] for key in table.foreign_keys))
+        self.write_post_data(table, 'constraints', entry['constraints'])
+
+    @status_logger
+    def write_triggers(self, table):
+        """Write TRIGGERs existing on `table` to the post-data file and manifest
+
+        :Parameters:
+          - `table`: an instance of a :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader.Table` object that represents the table to read/write.
+
+        Returns None
+        """
+        entry = self.table_entry(table.name)
+        entry['triggers'] = PostgresWriter.write_triggers(self, table)
+        self.write_post_data(table, 'triggers', entry['triggers'])
+
+    @status_logger
+    def write_contents(self, table, reader, key_range=None):
+        """Write the data contents of `table`, or of a key range of it, to a data file of its own.
+
+        :Parameters:
+          - `table`: an instance of a :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader.Table` object that represents the table to read/write.
+          - `reader`: an instance of a :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader` object that allows reading from the data source.
+          - `key_range`: optional `(lower, upper)` range of the table key, or partition name, to restrict the copy to, see :py:meth:`mysql2pgsql.lib.mysql_reader.MysqlReader.key_ranges`.
+
+        Returns the manifest entry of the data file, see :py:meth:`add_contents`
+        """
+        name = table.name.replace(os.sep, '_') + key_range_suffix(key_range)
+        name = os.path.join(DATA_DIRECTORY, '%s.copy%s' % (name, EXTENSIONS[self.compression]))
+        copy = 'COPY "%s" (%s) FROM stdin;' % (table.name, ', '.join('"%s"' % c['name'] for c in table.columns))
+
+        rows = PostgresDbWriter.FileObjFaker(table, self.encode_rows(table, reader.read(table, key_range)), None,
+                                             self.verbose)
+        with closing(rows), open_compressed(os.path.join(self.path, name), self.compression) as f:
+            f.write(DATA_PREAMBLE + copy.encode('utf8') + '\n')
+            for block in iter(rows.read, ''):
+                f.write(block.encode('utf8') if isinstance(block, unicode) else block)
+            f.write('\\.\n')
+
+        entry = OrderedDict([
+            ('table', table.name),
+            ('file', name),
+            ('key_range', key_range if isinstance(key_range, basestring) else key_range and list(key_range)),
+            ('copy', copy),
+            ('size', os.path.getsize(os.path.join(self.path, name)))])
+        if not self.data_only:
+            self.add_contents(entry)
+        return entry
+
+    def add_contents(self, entry):
+        """Adds a data file, as returned by :py:meth:`write_contents`, to the manifest"""
+        self.table_entry(entry['table'])['data'].append(entry)
+
+    def close(self):
+        """Closes the output files and writes the manifest"""
+        if self.data_only:
+            return
+        self.f.close()
+        self.post_data.close()
+        manifest = OrderedDict([
+            ('version', 1),
+            ('compression', self.compression),
+            ('schema', SCHEMA_FILE),
+            ('post_data', POST_DATA_FILE),
+            ('tables', self.tables.values())])
+        path = os.path.join(self.path, MANIFEST_FILE)
+        with open(path + '.tmp', 'wb') as f:
+            json.dump(manifest, f, indent=2)
+        os.rename(path + '.tmp', path)
@@ -8,6 +8,27 @@ from .postgres_writer import PostgresWriter
 from . import print_row_progress, status_logger
 
 
+class BytesFile(object):
+    """Output file taking UTF-8 encoded :py:obj:`str` as well as
+    :py:obj:`unicode`, for data read as bytes: unlike a :py:mod:`codecs`
+    writer, it writes the former as they are instead of decoding them
+    first.
+
+    :Parameters:
+      - `f`: the :py:obj:`file` to write to, opened in binary mode
+    """
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf8')
+        self.f.write(data)
+
+    def close(self):
+        self.f.close()
+
+
 class PostgresFileWriter(PostgresWriter):
     """Class used to ouput the PostgreSQL
     compatable DDL and/or data to the specified
@@ -112,17 +133,17 @@ SET client_min_messages = warning;
         self.f.write('\n'.join(super(PostgresFileWriter, self).write_triggers(table)))
 
     @status_logger
-    def write_contents(self, table, reader):
+    def write_contents(self, table, reader, key_range=None):
         """Write the data contents of `table` to the output file.
 
         :Parameters:
           - `table`: an instance of a :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader.Table` object that represents the table to read/write.
           - `reader`: an instance of a :py:class:`mysql2pgsql.lib.mysql_reader.MysqlReader` object that allows reading from the data source.
+          - `key_range`: optional `(lower, upper)` range of the table key, or partition name, to restrict the copy to, see :py:meth:`mysql2pgsql.lib.mysql_reader.MysqlReader.key_ranges`.
 
         Returns None
         """
         # start variable optimiztions
-        pr = self.process_row
         f_write = self.f.write
         verbose = self.verbose
         # end variable optimiztions
@@ -141,22 +162,26 @@ COPY "%(table_name)s" (%(column_names)s) FROM stdin;
             start_time = tt()
             prev_val_len = 0
             prev_row_count = 0
-        for i, row in enumerate(reader.read(table), 1):
-            row = list(row)
-            pr(table, row)
-            try:
-                f_write(u'%s\n' % (u'\t'.join(row)))
-            except UnicodeDecodeError:
-                f_write(u'%s\n' % (u'\t'.join(r.decode('utf-8') for r in row)))
-            if verbose:
-                if (i % 20000) == 0:
-                    now = tt()
-                    elapsed = now - start_time
-                    val = '%.2f rows/sec [%s] ' % ((i - prev_row_count) / elapsed, i)
-                    print_row_progress('%s%s' % (("\b" * prev_val_len), val))
-                    prev_val_len = len(val) + 3
-                    start_time = now
-                    prev_row_count = i
+        lines = self.encode_rows(table, reader.read(table, key_range))
+        try:
+            for i, line in enumerate(lines, 1):
+                try:
+                    f_write(line)
+                except UnicodeDecodeError:
+                    f_write(line.decode('utf-8'))
+                if verbose:
+                    if (i % 20000) == 0:
+                        now = tt()
+                        elapsed = now - start_time
+                        val = '%.2f rows/sec [%s] ' % ((i - prev_row_count) / elapsed, i)
+                        print_row_progress('%s%s' % (("\b" * prev_val_len), val))
+                        prev_val_len = len(val) + 3
+                        start_time = now
+                        prev_row_count = i
+        finally:
+            # stops the pipeline threads when writing fails
+            if hasattr(lines, 'close'):
+                lines.close()
 
         f_write("\\.\n\n")
         if verbose:
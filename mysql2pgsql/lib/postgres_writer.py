@@ -3,18 +3,38 @@ from __future__ import absolute_import
 import re
 from cStringIO import StringIO
 from datetime import date, datetime, timedelta
+from functools import partial
+from itertools import chain, imap, islice, izip, repeat
+from operator import add
 
 from psycopg2.extensions import AsIs, Binary, QuotedString
 from pytz import timezone
 
+from .pipeline import BLOCK_SIZE, flatten, pipelined
+
+# functions of a column MySQL RANGE partitions on, turning a partition bound
+# into the matching bound of the column
+PARTITION_FUNCTIONS = {
+    'year': lambda value: "'%04d-01-01'" % int(value),
+    'to_days': lambda value: "'%s'" % date.fromordinal(max(int(value) - 365, 1)).isoformat(),
+}
+
 
 class PostgresWriter(object):
     """Base class for :py:class:`mysql2pgsql.lib.postgres_file_writer.PostgresFileWriter`
     and :py:class:`mysql2pgsql.lib.postgres_db_writer.PostgresDbWriter`.
     """
 
-    def __init__(self, index_prefix, tz=False):
+    def __init__(self, index_prefix, tz=False, batch_size=0, pipeline=False):
         self.column_types = {}
+        self.converters = {}
+        self.batch_converters = {}
+        self.batch_size = batch_size or 0
+        self.pipeline = pipeline
+        self.metrics = None
+        self.profiler = None
+        # whether tables are created UNLOGGED, to be switched with set_logged once loaded
+        self.unlogged = False
         self.index_prefix = index_prefix if index_prefix else ''
         if tz:
             self.tz = timezone('UTC')
@@ -146,49 +166,175 @@ class PostgresWriter(object):
                 comments.append('COMMENT ON COLUMN %s.%s is %s;' % (table.name, column['name'], QuotedString(column['comment']).getquoted()))
         return comments
 
+    def column_converter(self, column):
+        """Returns a callable that converts a single MySQL value of
+        `column` into its PostgreSQL copy representation. Everything
+        that only depends on the column type is decided here, once,
+        instead of for every cell.
+        """
+        column_type = self.column_type(column)
+        null = self.column_null(column)
+
+        if 'bit' in column_type:
+            def converter(value):
+                return null if value is None else bin(ord(value))[2:]
+            return converter
+
+        if column_type == 'bytea':
+            convert_string = _convert_bytea
+        elif 'text[' in column_type:
+            convert_string = _convert_set
+        else:
+            convert_string = _escape
+
+        if column_type == 'boolean':
+            # We got here because you used a tinyint(1), if you didn't want a bool, don't use that type
+            convert_other = _convert_boolean
+        else:
+            convert_other = self._convert_value
+
+        def converter(value):
+            if value is None:
+                return null
+            if isinstance(value, basestring):
+                return convert_string(value)
+            return convert_other(value)
+        return converter
+
+    def column_null(self, column):
+        """Copy representation of the NULL values of `column`"""
+        if 'timestamp' in self.column_type(column) and column['default']:
+            return ('1970-01-01T00:00:00.000000' + self.tz_offset) if self.tz else '1970-01-01 00:00:00'
+        return '\\N'
+
+    def column_batch_converter(self, column):
+        """Returns a callable that converts a list of MySQL values of
+        `column` into the list of their copy representations, as
+        :py:meth:`column_converter` does one by one. Numbers, dates,
+        datetimes and text are converted a whole list at a time, falling
+        back to converting one value at a time on any value of an
+        unexpected type.
+        """
+        convert_value = self.column_converter(column)
+        column_type = self.column_type(column)
+        null = self.column_null(column)
+
+        if column_type in ('smallint', 'integer', 'bigint', 'real', 'double') or column_type.startswith('numeric'):
+            # AsIs(value).getquoted() is str(value)
+            convert_batch = lambda values: map(str, values)
+        elif column_type in ('date', 'timestamp') and not self.tz:
+            convert_batch = lambda values: [value.isoformat() for value in values]
+        elif column['type'] in ('char', 'varchar', 'tinytext', 'text', 'mediumtext', 'longtext') or \
+                column['type'].startswith('enum'):
+            convert_batch = escape_column
+        else:
+            return lambda values: map(convert_value, values)
+
+        def converter(values):
+            try:
+                if None not in values:
+                    return convert_batch(values)
+                converted = iter(convert_batch([value for value in values if value is not None]))
+                return [null if value is None else next(converted) for value in values]
+            except (AttributeError, TypeError):
+                return map(convert_value, values)
+        return converter
+
+    def block_encoder(self, table):
+        """Returns a callable that turns a list of rows read from MySQL
+        into the list of their lines of PostgreSQL copy data, converting
+        the rows column by column, see :py:meth:`column_batch_converter`.
+        """
+        converters = self.batch_converters.get(table.name)
+        if converters is None:
+            converters = self.batch_converters[table.name] = [self.column_batch_converter(c) for c in table.columns]
+
+        def encode(rows):
+            columns = [convert(list(values)) for convert, values in izip(converters, izip(*rows))]
+            columns[-1] = map(add, columns[-1], repeat('\n', len(rows)))
+            try:
+                return map('\t'.join, izip(*columns))
+            except UnicodeDecodeError:
+                return [u'\t'.join(v.decode('utf8') if isinstance(v, str) else v for v in values)
+                        for values in izip(*columns)]
+        return encode
+
+    def encode_rows(self, table, rows, row_encoder=None):
+        """Returns an iterator of the lines of copy data of `rows` of `table`.
+        Rows are converted one by one with `row_encoder`, by default
+        :py:meth:`row_encoder`, or column by column in blocks of
+        `batch_size` rows when it is set, see :py:meth:`block_encoder`.
+        With `pipeline` set, reading and converting rows each run in a
+        thread of their own, see :py:func:`mysql2pgsql.lib.pipeline.pipelined`,
+        until the returned iterator is exhausted or closed: callers close
+        it when they stop early.
+        Within a phase measured by `metrics`, rows go by blocks so that
+        reading, converting and writing them can be timed apart.
+        """
+        batch = self.batch_size and table.columns and not row_encoder
+        stage = self.metrics.stage if self.metrics else None
+        if not (batch or self.pipeline or stage):
+            return imap(row_encoder or self.row_encoder(table), rows)
+        if batch:
+            encode, size = self.block_encoder(table), self.batch_size
+        else:
+            encode, size = partial(map, row_encoder or self.row_encoder(table)), BLOCK_SIZE
+        source, rows = rows, iter(rows)
+        blocks = iter(lambda: list(islice(rows, size)), [])
+        if stage:
+            blocks, encode = stage.fetching(blocks), stage.converting(encode)
+        pipeline = pipelined(blocks, encode) if self.pipeline else None
+        lines = pipeline or imap(encode, blocks)
+        if stage:
+            lines = stage.waiting(lines)
+        return flatten(lines, pipeline, source) if pipeline else chain.from_iterable(lines)
+
+    def column_converters(self, table):
+        """Returns the list of :py:meth:`column_converter` callables
+        for the columns of `table`, building them on first use.
+        """
+        converters = self.converters.get(table.name)
+        if converters is None:
+            converters = self.converters[table.name] = [self.column_converter(c) for c in table.columns]
+        return converters
+
+    def row_encoder(self, table):
+        """Returns a callable that turns a row read from MySQL into
+        a single line of PostgreSQL copy data.
+        """
+        converters = self.column_converters(table)
+
+        def encode(row):
+            values = [convert(value) for convert, value in izip(converters, row)]
+            try:
+                return '%s\n' % '\t'.join(values)
+            except UnicodeDecodeError:
+                return u'%s\n' % u'\t'.join(v.decode('utf8') if isinstance(v, str) else v for v in values)
+        return encode
+
     def process_row(self, table, row):
         """Examines row data from MySQL and alters
         the values when necessary to be compatible with
         sending to PostgreSQL via the copy command
         """
-        for index, column in enumerate(table.columns):
-            hash_key = hash(frozenset(column.items()))
-            column_type = self.column_types[hash_key] if hash_key in self.column_types else self.column_type(column)
-            if row[index] == None and ('timestamp' not in column_type or not column['default']):
-                row[index] = '\N'
-            elif row[index] == None and column['default']:
-                if self.tz:
-                    row[index] = '1970-01-01T00:00:00.000000' + self.tz_offset
-                else:
-                    row[index] = '1970-01-01 00:00:00'
-            elif 'bit' in column_type:
-                row[index] = bin(ord(row[index]))[2:]
-            elif isinstance(row[index], (str, unicode, basestring)):
-                if column_type == 'bytea':
-                    row[index] = Binary(row[index]).getquoted()[1:-8] if row[index] else row[index]
-                elif 'text[' in column_type:
-                    row[index] = '{%s}' % ','.join('"%s"' % v.replace('"', r'\"') for v in row[index].split(','))
-                else:
-                    row[index] = row[index].replace('\\', r'\\').replace('\n', r'\n').replace(
-                        '\t', r'\t').replace('\r', r'\r').replace('\0', '')
-            elif column_type == 'boolean':
-                # We got here because you used a tinyint(1), if you didn't want a bool, don't use that type
-                row[index] = 't' if row[index] not in (None, 0) else 'f' if row[index] == 0 else row[index]
-            elif isinstance(row[index], (date, datetime)):
-                if isinstance(row[index], datetime) and self.tz:
-                    try:
-                        if row[index].tzinfo:
-                            row[index] = row[index].astimezone(self.tz).isoformat()
-                        else:
-                            row[index] = datetime(*row[index].timetuple()[:6], tzinfo=self.tz).isoformat()
-                    except Exception as e:
-                        print e.message
-                else:
-                    row[index] = row[index].isoformat()
-            elif isinstance(row[index], timedelta):
-                row[index] = datetime.utcfromtimestamp(_get_total_seconds(row[index])).time().isoformat()
-            else:
-                row[index] = AsIs(row[index]).getquoted()
+        for index, convert in enumerate(self.column_converters(table)):
+            row[index] = convert(row[index])
+
+    def _convert_value(self, value):
+        if isinstance(value, (date, datetime)):
+            if isinstance(value, datetime) and self.tz:
+                try:
+                    if value.tzinfo:
+                        return value.astimezone(self.tz).isoformat()
+                    else:
+                        return datetime(*value.timetuple()[:6], tzinfo=self.tz).isoformat()
+                except Exception as e:
+                    print e.message
+                    return value
+            return value.isoformat()
+        elif isinstance(value, timedelta):
+            return datetime.utcfromtimestamp(_get_total_seconds(value)).time().isoformat()
+        return AsIs(value).getquoted()
 
     def table_attributes(self, table):
         primary_keys = []
@@ -237,16 +383,74 @@ class PostgresWriter(object):
             serial_key_sql.append('SELECT pg_catalog.setval(\'"%s"\', %s, true);' % (serial_key_seq, maxval))
 
         table_sql.append('DROP TABLE IF EXISTS "%s" CASCADE;' % table.name)
-        table_sql.append('CREATE TABLE "%s" (\n%s\n)\nWITHOUT OIDS;' % (table.name.encode('utf8'), columns))
+        partition_by, partitions = self.partition_statements(table)
+        if partition_by:
+            # partitioned tables can't be unlogged, their partitions are
+            table_sql.append('CREATE TABLE "%s" (\n%s\n)\nPARTITION BY %s\nWITHOUT OIDS;' % (
+                table.name.encode('utf8'), columns, partition_by))
+            table_sql.extend('CREATE %sTABLE "%s" PARTITION OF "%s" %s;' % (
+                'UNLOGGED ' if self.unlogged else '', name, table.name.encode('utf8'), bound)
+                for name, bound in partitions)
+        else:
+            table_sql.append('CREATE %sTABLE "%s" (\n%s\n)\nWITHOUT OIDS;' % ('UNLOGGED ' if self.unlogged else '',
+                                                                       table.name.encode('utf8'), columns))
         table_sql.extend(self.table_comments(table))
         return (table_sql, serial_key_sql)
 
+    def partition_statements(self, table):
+        """Returns how `table` is partitioned as `(partition_by, partitions)`:
+        its ``PARTITION BY`` clause and the `(name, bound)` of each of its
+        partitions, named after the table and the MySQL partition.
+
+        Returns `(None, [])` when the table isn't partitioned, or when its
+        partitioning has no Postgres counterpart and it is created as a
+        plain table: expressions other than a column, or than one of the
+        :py:data:`PARTITION_FUNCTIONS` of a column in RANGE partitioning,
+        and LIST partitioning on several columns. Subpartitions are folded
+        into their partition. RANGE partitions on nullable columns get a
+        DEFAULT partition, where MySQL keeps NULL in its first partition.
+        """
+        partitioning = table.partitioning
+        method, function, columns = partitioning.get('method'), partitioning.get('function'), partitioning.get('columns')
+        if (not columns or (function and (method != 'RANGE' or function not in PARTITION_FUNCTIONS)) or
+                (method == 'LIST' and len(columns) > 1)):
+            return None, []
+        partitions = partitioning['partitions']
+        names = ['%s_%s' % (table.name, partition['name']) for partition in partitions]
+        if method == 'RANGE':
+            bounds, lower = [], ['MINVALUE'] * len(columns)
+            for partition in partitions:
+                upper = [value if value == 'MAXVALUE' or not function else PARTITION_FUNCTIONS[function](value)
+                         for value in partition['values']]
+                bounds.append('FOR VALUES FROM (%s) TO (%s)' % (', '.join(lower), ', '.join(upper)))
+                lower = upper
+            if any(column['null'] for column in table.columns if column['name'] in columns):
+                names.append('%s_default' % table.name)
+                bounds.append('DEFAULT')
+        elif method == 'LIST':
+            bounds = ['FOR VALUES IN (%s)' % ', '.join(partition['values']) for partition in partitions]
+        else:
+            method = 'HASH'
+            bounds = ['FOR VALUES WITH (MODULUS %d, REMAINDER %d)' % (len(partitions), i)
+                      for i in range(len(partitions))]
+        return ('%s (%s)' % (method, ', '.join('"%s"' % column for column in columns)),
+                [(name.encode('utf8'), bound) for name, bound in zip(names, bounds)])
+
     def write_indexes(self, table):
+        primary_sql, index_sql = self.index_statements(table)
+        return primary_sql + [sql for statements in index_sql for sql in statements]
+
+    def index_statements(self, table):
+        """Returns the DDL of the `table` indexes as `(primary_sql, index_sql)`:
+        the statements adding its primary key, and the statements of each of
+        its other indexes, grouped by index.
+        """
+        primary_sql = []
         index_sql = []
         primary_index = [idx for idx in table.indexes if idx.get('primary', None)]
         index_prefix = self.index_prefix
         if primary_index:
-            index_sql.append('ALTER TABLE "%(table_name)s" ADD CONSTRAINT "%(index_name)s_pkey" PRIMARY KEY(%(column_names)s);' % {
+            primary_sql.append('ALTER TABLE "%(table_name)s" ADD CONSTRAINT "%(index_name)s_pkey" PRIMARY KEY(%(column_names)s);' % {
                 'table_name': table.name,
                 'index_name': '%s%s_%s' % (index_prefix, table.name,
                                            '_'.join(primary_index[0]['columns'])),
@@ -257,15 +461,20 @@ class PostgresWriter(object):
                 continue
             unique = 'UNIQUE ' if index.get('unique', None) else ''
             index_name = '%s%s_%s' % (index_prefix, table.name, '_'.join(index['columns']))
-            index_sql.append('DROP INDEX IF EXISTS "%s" CASCADE;' % index_name)
-            index_sql.append('CREATE %(unique)sINDEX "%(index_name)s" ON "%(table_name)s" (%(column_names)s);' % {
-                'unique': unique,
-                'index_name': index_name,
-                'table_name': table.name,
-                'column_names': ', '.join('"%s"' % col for col in index['columns']),
-            })
+            index_sql.append([
+                'DROP INDEX IF EXISTS "%s" CASCADE;' % index_name,
+                'CREATE %(unique)sINDEX "%(index_name)s" ON "%(table_name)s" (%(column_names)s);' % {
+                    'unique': unique,
+                    'index_name': index_name,
+                    'table_name': table.name,
+                    'column_names': ', '.join('"%s"' % col for col in index['columns']),
+                }])
 
-        return index_sql
+        return primary_sql, index_sql
+
+    def set_logged(self, table):
+        names = [name for name, _ in self.partition_statements(table)[1]] or [table.name]
+        return ['ALTER TABLE "%s" SET LOGGED;' % name for name in names]
 
     def write_constraints(self, table):
         constraint_sql = []
@@ -307,9 +516,57 @@ class PostgresWriter(object):
     def close(self):
         raise NotImplementedError
 
-    def write_contents(self, table, reader):
+    def write_contents(self, table, reader, key_range=None):
         raise NotImplementedError
 
+
+# characters escaped in copy text data, NUL being dropped
+_special = re.compile(r'[\\\n\t\r\0]')
+_find_special = _special.search
+
+# values up to that length are scanned once for special characters, longer ones
+# go straight to str.replace, whose memchr based search beats the regex scan
+_SCAN_LIMIT = 128
+
+
+def _escape(value):
+    """Escapes `value` for the copy text format. Most values have nothing
+    to escape and are returned as they are after a single scan.
+    """
+    if len(value) < _SCAN_LIMIT and _find_special(value) is None:
+        return value
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace(
+        '\t', r'\t').replace('\r', r'\r').replace('\0', '')
+
+
+def escape_column(values):
+    """Escapes a batch of string `values` of a column, see :py:func:`_escape`.
+    The whole batch is scanned at once, since a clean batch is made of clean
+    values only, and each value is only escaped on its own when it isn't.
+    """
+    try:
+        batch = ''.join(values)
+    except UnicodeDecodeError:
+        # non ASCII bytes next to unicode values
+        batch = None
+    if batch is not None and '\\' not in batch and '\n' not in batch and '\t' not in batch and \
+            '\r' not in batch and '\0' not in batch:
+        return list(values)
+    return [_escape(value) for value in values]
+
+
+def _convert_bytea(value):
+    return Binary(value).getquoted()[1:-8] if value else value
+
+
+def _convert_set(value):
+    return '{%s}' % ','.join('"%s"' % v.replace('"', r'\"') for v in value.split(','))
+
+
+def _convert_boolean(value):
+    return 't' if value not in (None, 0) else 'f' if value == 0 else value
+
+
 # Original fix for Py2.6: https://github.com/mozilla/mozdownload/issues/73
 def _get_total_seconds(dt):
     # Keep backward compatibility with Python 2.6 which doesn't have this method
@@ -0,0 +1,89 @@
+from __future__ import with_statement, absolute_import
+
+import cProfile
+import os
+import pstats
+import threading
+from contextlib import contextmanager
+from cStringIO import StringIO
+
+from .mysql_reader import key_range_suffix
+
+# name of the profile of the whole run, the data of every table is profiled apart
+RUN_PROFILE = 'convert.pstats'
+DATA_DIRECTORY = 'data'
+REPORT_FILE = 'report.txt'
+
+# functions listed per profile in the report
+TOP = 25
+
+
+class Profiler(object):
+    """Profiles a conversion with :py:mod:`cProfile` to a directory of
+    :py:mod:`pstats` files: the data of every table, or of every key range
+    or partition of it, in `data/<table>[.<lower>-<upper>|.<partition>].pstats` and whatever else the
+    run does in :py:data:`RUN_PROFILE`.
+
+    Only the thread entering a profile is profiled. With `pipeline` set,
+    reading and converting rows run in threads of their own and are left
+    out, so profile without it.
+
+    :Parameters:
+      - `path`: the directory the profiles are written to, created if missing
+      - `top`: number of functions listed per profile by :py:meth:`report`
+    """
+    def __init__(self, path, top=TOP):
+        self.path = path
+        self.top = top
+        self.local = threading.local()
+        for directory in (path, os.path.join(path, DATA_DIRECTORY)):
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+    @contextmanager
+    def profile(self, name):
+        """Profiles the block to `name`, relative to the directory. A
+        profile running in the same thread is paused meanwhile, so that
+        every call is counted once.
+        """
+        stack = self.local.__dict__.setdefault('stack', [])
+        if stack:
+            stack[-1].disable()
+        profile = cProfile.Profile()
+        stack.append(profile)
+        profile.enable()
+        try:
+            yield profile
+        finally:
+            profile.disable()
+            stack.pop()
+            if stack:
+                stack[-1].enable()
+            profile.dump_stats(os.path.join(self.path, name))
+
+    def profile_data(self, table_name, key_range=None):
+        """Profiles the block to the data profile of `table_name`, or of its `key_range`"""
+        name = table_name.replace(os.sep, '_') + key_range_suffix(key_range)
+        return self.profile(os.path.join(DATA_DIRECTORY, name + '.pstats'))
+
+    def report(self):
+        """Writes the functions taking the most time, in all profiles
+        together then in every data profile, slowest first, to
+        :py:data:`REPORT_FILE`. Returns the part about all profiles.
+        """
+        data = os.path.join(self.path, DATA_DIRECTORY)
+        files = [os.path.join(data, name) for name in os.listdir(data) if name.endswith('.pstats')]
+        run = os.path.join(self.path, RUN_PROFILE)
+        out = StringIO()
+        total = pstats.Stats(*(files + [run] if os.path.isfile(run) else files), stream=out)
+        out.write('All profiles, top %s functions by own time\n' % self.top)
+        total.sort_stats('tottime').print_stats(self.top)
+        summary = out.getvalue()
+
+        profiles = [(pstats.Stats(f, stream=out), f) for f in files]
+        for stats, f in sorted(profiles, key=lambda p: p[0].total_tt, reverse=True):
+            out.write('\n%s, %.3fs\n' % (os.path.relpath(f, self.path), stats.total_tt))
+            stats.sort_stats('tottime').print_stats(self.top)
+        with open(os.path.join(self.path, REPORT_FILE), 'wb') as f:
+            f.write(out.getvalue())
+        return summary
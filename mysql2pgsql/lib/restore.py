@@ -0,0 +1,167 @@
+from __future__ import with_statement, absolute_import
+
+import codecs
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import closing
+
+from . import print_start_table, print_table_actions
+from .errors import GeneralException
+from .index_builder import IndexBuilder
+from .postgres_directory_writer import MANIFEST_FILE, open_compressed
+
+
+class CopyData(object):
+    """A file-like class reading the rows of a data file written by
+    :py:class:`mysql2pgsql.lib.postgres_directory_writer.PostgresDirectoryWriter`
+    for :py:meth:`psycopg2.cursor.copy_expert`, leaving out the session
+    settings and the ``COPY`` statement heading it and the end of data
+    marker closing it.
+
+    :Parameters:
+      - `f`: the data file, opened for reading
+      - `size`: number of bytes read at once when :py:meth:`read` is called without a size
+    """
+    trailer = '\\.\n'
+
+    def __init__(self, f, size=256 * 1024):
+        self.f = f
+        self.size = size
+        self.header = True
+        self.pending = ''
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size
+        data = self.pending
+        while True:
+            chunk = self.f.read(size)
+            data += chunk
+            if self.header:
+                copy = 0 if data.startswith('COPY ') else data.find('\nCOPY ')
+                end = data.find('\n', copy + 1) if copy >= 0 else -1
+                if chunk and end < 0:
+                    continue
+                data = data[end + 1:] if end >= 0 else ''
+                self.header = False
+            if not chunk:
+                self.pending = ''
+                return data[:-len(self.trailer)] if data.endswith(self.trailer) else data
+            # the end of data marker may be split over two reads
+            if len(data) > len(self.trailer):
+                self.pending = data[-len(self.trailer):]
+                return data[:-len(self.trailer)]
+
+
+class Restorer(object):
+    """Restores a dump written to a directory by
+    :py:class:`mysql2pgsql.lib.postgres_directory_writer.PostgresDirectoryWriter`.
+
+    The schema is created first, then the data files are copied over
+    `workers` connections at once, the largest files first, and the
+    primary keys, indexes, constraints and triggers are added last over
+    `index_workers` connections with a
+    :py:class:`mysql2pgsql.lib.index_builder.IndexBuilder`.
+
+    :Parameters:
+      - `path`: the directory of the dump
+      - `open_writer`: callable returning a new :py:class:`mysql2pgsql.lib.postgres_db_writer.PostgresDbWriter`, called once per connection
+      - `workers`: number of connections copying data at once
+      - `index_workers`: number of connections adding indexes, constraints and triggers at once
+      - `verbose`: whether or not to log progress to :py:obj:`stdout`
+    """
+    def __init__(self, path, open_writer, workers=1, index_workers=1, verbose=False):
+        self.path = path
+        self.open_writer = open_writer
+        self.workers = max(workers or 1, 1)
+        self.index_workers = max(index_workers or 1, 1)
+        self.verbose = verbose
+
+    def manifest(self):
+        """Loads the manifest of the dump"""
+        path = os.path.join(self.path, MANIFEST_FILE)
+        if not os.path.isfile(path):
+            raise GeneralException('%s is not a dump directory, it has no %s' % (self.path, MANIFEST_FILE))
+        with open(path, 'rb') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != 1:
+            raise GeneralException('unsupported dump version %s' % manifest.get('version'))
+        return manifest
+
+    def restore(self):
+        manifest = self.manifest()
+        self.restore_schema(manifest)
+        self.restore_data(manifest)
+        self.restore_post_data(manifest)
+
+    def restore_schema(self, manifest):
+        if self.verbose:
+            print_start_table('CREATING SCHEMA')
+        with codecs.open(os.path.join(self.path, manifest['schema']), 'rb', 'utf-8') as f:
+            sql = f.read()
+        writer = self.open_writer()
+        try:
+            with closing(writer.conn.cursor()) as cur:
+                cur.execute(sql)
+            writer.conn.commit()
+        finally:
+            writer.close()
+
+    def restore_data(self, manifest):
+        """Copies the data files over `workers` connections, the largest
+        first. The first failure stops the copy and is raised once the
+        running copies are over.
+        """
+        self.pending = sorted((entry for table in manifest['tables'] for entry in table['data']),
+                              key=lambda entry: entry['size'], reverse=True)
+        if self.verbose:
+            print_start_table('COPYING %s DATA FILES WITH %s WORKERS' % (len(self.pending), self.workers))
+        self.lock = threading.Lock()
+        self.error = None
+        threads = [threading.Thread(target=self.copy_files, args=(manifest['compression'], ))
+                   for _ in range(min(self.workers, len(self.pending)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.error:
+            raise self.error[0], self.error[1], self.error[2]
+
+    def copy_files(self, compression):
+        writer = None
+        try:
+            writer = self.open_writer()
+            while True:
+                with self.lock:
+                    if not self.pending or self.error:
+                        return
+                    entry = self.pending.pop(0)
+                self.copy_file(writer, entry, compression)
+        except:
+            with self.lock:
+                self.error = self.error or sys.exc_info()
+        finally:
+            if writer:
+                writer.close()
+
+    def copy_file(self, writer, entry, compression):
+        if self.verbose:
+            print_table_actions('START  - COPYING %s' % entry['file'])
+            start = time.time()
+        with closing(open_compressed(os.path.join(self.path, entry['file']), compression, 'rb')) as f:
+            writer.copy_expert(entry['copy'], CopyData(f))
+        if self.verbose:
+            print_table_actions('FINISH - COPYING %s in %.2fs' % (entry['file'], time.time() - start))
+
+    def restore_post_data(self, manifest):
+        if self.verbose:
+            print_start_table('ADDING INDEXES, CONSTRAINTS AND TRIGGERS WITH %s WORKERS' % self.index_workers)
+        tables = manifest['tables']
+        builder = IndexBuilder(self.open_writer, self.index_workers, verbose=self.verbose)
+        builder.run(builder.statement_tasks(
+            [(table['name'], table['primary_key'], table['indexes']) for table in tables],
+            [(table['name'], table['constraints'], table['references']) for table in tables],
+            [(table['name'], table['triggers']) for table in tables]))
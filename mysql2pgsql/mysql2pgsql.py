@@ -1,12 +1,16 @@
-from __future__ import absolute_import
+from __future__ import with_statement, absolute_import
 
 import codecs
+from functools import partial
 
 from .lib import print_red
 from .lib.mysql_reader import MysqlReader
-from .lib.postgres_file_writer import PostgresFileWriter
-from .lib.postgres_db_writer import PostgresDbWriter
+from .lib.postgres_file_writer import BytesFile, PostgresFileWriter
+from .lib.postgres_db_writer import ConnectionPool, PostgresDbWriter
+from .lib.postgres_directory_writer import PostgresDirectoryWriter
 from .lib.converter import Converter
+from .lib.profiler import RUN_PROFILE, Profiler
+from .lib.restore import Restorer
 from .lib.config import Config
 from .lib.errors import ConfigurationFileInitialized
 
@@ -27,14 +31,57 @@ class Mysql2Pgsql(object):
             writer = PostgresFileWriter(self._get_file(self.file_options['destination']['file']), 
                                         self.run_options.verbose, 
                                         index_prefix=self.file_options.get("index_prefix"),
-                                        tz=self.file_options.get('timezone'))
+                                        tz=self.file_options.get('timezone'),
+                                        batch_size=self.file_options.get('batch_size'),
+                                        pipeline=self.file_options.get('pipeline'))
+        elif self.file_options['destination'].get('directory', None):
+            writer = PostgresDirectoryWriter(self.file_options['destination']['directory'],
+                                             self.run_options.verbose,
+                                             compression=self.file_options['destination'].get('compression', None),
+                                             index_prefix=self.file_options.get("index_prefix"),
+                                             tz=self.file_options.get('timezone'),
+                                             batch_size=self.file_options.get('batch_size'),
+                                             pipeline=self.file_options.get('pipeline'))
         else:
             writer = PostgresDbWriter(self.file_options['destination']['postgres'], 
                                       self.run_options.verbose, 
                                       index_prefix=self.file_options.get("index_prefix"),
-                                      tz=self.file_options.get('timezone'))
+                                      tz=self.file_options.get('timezone'),
+                                      batch_size=self.file_options.get('batch_size'),
+                                      pipeline=self.file_options.get('pipeline'))
 
-        Converter(reader, writer, self.file_options, self.run_options.verbose).convert()
+        profiler = None
+        profile = getattr(self.run_options, 'profile', None) or self.file_options.get('profile', None)
+        if profile:
+            # the workers loading data in parallel profile it too
+            self.file_options['profile'] = profile
+            profiler = writer.profiler = Profiler(profile)
+
+        converter = Converter(reader, writer, self.file_options, self.run_options.verbose)
+        if getattr(self.run_options, 'tail', False):
+            converter.tail()
+        elif profiler:
+            with profiler.profile(RUN_PROFILE):
+                converter.convert()
+            print(profiler.report())
+        else:
+            converter.convert()
+
+    def restore(self, path):
+        pool = ConnectionPool(self.file_options['destination']['postgres'])
+        open_writer = partial(PostgresDbWriter, self.file_options['destination']['postgres'],
+                              pool=pool,
+                              index_prefix=self.file_options.get("index_prefix"),
+                              tz=self.file_options.get('timezone'))
+        try:
+            Restorer(path, open_writer,
+                     workers=self.file_options.get('workers', 1),
+                     index_workers=self.file_options.get('index_workers', 1),
+                     verbose=self.run_options.verbose).restore()
+        finally:
+            pool.closeall()
 
     def _get_file(self, file_path):
+        if not self.file_options['mysql'].get('use_unicode', True):
+            return BytesFile(open(file_path, 'wb'))
         return codecs.open(file_path, 'wb', 'utf-8')
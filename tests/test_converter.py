@@ -2,6 +2,7 @@ from __future__ import with_statement, absolute_import
 import os
 import sys
 import re
+import tempfile
 
 from . import WithReader
 
@@ -9,6 +10,7 @@ sys.path.append(os.path.abspath('../'))
 
 from mysql2pgsql.lib.postgres_writer import PostgresWriter
 from mysql2pgsql.lib.converter import Converter
+from mysql2pgsql.lib import parallel
 
 class TestConverter(WithReader):
     def setUp(self):
@@ -21,3 +23,36 @@ class TestConverter(WithReader):
         Converter(self.reader, self.writer, {}, True).convert()
         Converter(self.reader, self.writer, {'force_truncate':True, 'supress_ddl': True}, True).convert()
 
+    def test_introspection_metrics(self):
+        f = tempfile.NamedTemporaryFile()
+        converter = Converter(self.reader, self.writer, {'metrics': f.name}, True)
+        tables = converter.tables()
+        for table in tables:
+            self.assertTrue(converter.metrics.totals[table.name]['introspection'] > 0)
+        # the definitions are all read by then, nothing is left to charge to the ddl phase
+        queries = []
+        query, self.reader.db.query = self.reader.db.query, lambda *args, **kwargs: queries.append(args) or query(*args, **kwargs)
+        try:
+            for table in tables:
+                self.writer.write_table(table)
+                self.writer.write_indexes(table)
+        finally:
+            self.reader.db.query = query
+        self.assertEqual(queries, [])
+
+    def test_work_units(self):
+        tables = list(self.reader.tables)
+        units = parallel.work_units(tables, self.reader)
+        self.assertEqual(len(units), len(tables))
+        rows = dict((t.name, t.rows) for t in tables)
+        assert all(rows[a[0]] >= rows[b[0]] for a, b in zip(units, units[1:]))
+
+    def test_work_units_chunks(self):
+        tables = list(self.reader.tables)
+        units = parallel.work_units(tables, self.reader, 4)
+        for table in tables:
+            ranges = [key_range for name, key_range in units if name == table.name]
+            if table.key_column and len(ranges) > 1:
+                self.assertEqual(len(ranges), 4)
+                self.assertEqual(sum(len(list(self.reader.read(table, r))) for r in ranges),
+                                 len(list(self.reader.read(table))))
@@ -0,0 +1,51 @@
+from __future__ import with_statement, absolute_import
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.abspath('../'))
+
+from mysql2pgsql.lib.metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mktemp()
+        self.metrics = Metrics(self.path)
+
+    def tearDown(self):
+        self.metrics.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_phase(self):
+        with self.metrics.phase('table1', 'ddl') as stage:
+            self.assertIs(self.metrics.stage, stage)
+        self.assertIs(self.metrics.stage, None)
+        self.metrics.close()
+        with open(self.path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(len(records), 1)
+        self.assertEqual((records[0]['table'], records[0]['phase']), ('table1', 'ddl'))
+        self.assertNotIn('rows', records[0])
+
+    def test_data_phase(self):
+        rows = [(i, 'row %d' % i) for i in range(25)]
+        blocks = [rows[i:i + 10] for i in range(0, len(rows), 10)]
+        encode = lambda block: ['%s\t%s\n' % row for row in block]
+        with self.metrics.phase('table1', 'data') as stage:
+            lines = [line for block in stage.waiting(map(stage.converting(encode), stage.fetching(blocks)))
+                     for line in block]
+        self.assertEqual(lines, encode(rows))
+        record = self.metrics.pop_records()[0]
+        self.assertEqual(record['rows'], 25)
+        self.assertEqual(record['bytes'], len(''.join(lines)))
+        self.assertEqual(self.metrics.pop_records(), [])
+
+        self.metrics.add(dict(record, seconds=1.0))
+        self.assertEqual(self.metrics.totals['table1']['rows'], 50)
+        summary = self.metrics.summary().splitlines()
+        self.assertEqual(len(summary), 2)
+        self.assertTrue(summary[1].startswith('table1 '))
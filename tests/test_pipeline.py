@@ -0,0 +1,35 @@
+from __future__ import with_statement, absolute_import
+import os
+import sys
+import threading
+import unittest
+
+sys.path.append(os.path.abspath('../'))
+
+from mysql2pgsql.lib.pipeline import pipelined, threaded
+
+
+class TestPipeline(unittest.TestCase):
+    def test_threaded(self):
+        self.assertEqual(list(threaded(iter(range(100)), depth=2)), range(100))
+
+    def test_threaded_error(self):
+        def failing():
+            yield 1
+            raise ValueError('read failed')
+        items = threaded(failing())
+        self.assertEqual(next(items), 1)
+        self.assertRaises(ValueError, next, items)
+
+    def test_threaded_close(self):
+        threads = threading.active_count()
+        items = threaded(iter(xrange(10 ** 9)), depth=2)
+        next(items)
+        items.close()
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_pipelined(self):
+        rows = [(i, 'row %d' % i) for i in range(2500)]
+        encode = lambda block: ['%s\t%s\n' % row for row in block]
+        blocks = [rows[i:i + 1000] for i in range(0, len(rows), 1000)]
+        self.assertEqual(list(pipelined(iter(blocks), encode)), map(encode, blocks))
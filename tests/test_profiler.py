@@ -0,0 +1,44 @@
+from __future__ import with_statement, absolute_import
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.abspath('../'))
+
+from mysql2pgsql.lib.profiler import Profiler, REPORT_FILE, RUN_PROFILE
+
+
+def busy(n):
+    return sum(i * i for i in xrange(n))
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_profile(self):
+        profiler = Profiler(self.path, top=5)
+        with profiler.profile(RUN_PROFILE):
+            busy(1000)
+            with profiler.profile_data('table1'):
+                busy(10000)
+            with profiler.profile_data('table1', (None, 10)):
+                busy(10000)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.path, 'data'))),
+                         ['table1.-10.pstats', 'table1.pstats'])
+        # calls made in a table profile are left out of the run profile
+        run = pstats.Stats(os.path.join(self.path, RUN_PROFILE)).stats
+        table = pstats.Stats(os.path.join(self.path, 'data', 'table1.pstats')).stats
+        calls = lambda stats: sum(s[1] for key, s in stats.items() if key[2] == '<genexpr>')
+        self.assertEqual(calls(run), 1001)
+        self.assertEqual(calls(table), 10001)
+
+        self.assertIn('All profiles', profiler.report())
+        with open(os.path.join(self.path, REPORT_FILE)) as f:
+            self.assertIn('data/table1.pstats', f.read())
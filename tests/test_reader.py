@@ -109,3 +109,81 @@ class TestMysqlReader(unittest.TestCase):
     def test_constraints(self):
         assert list(self.reader.tables)[1].foreign_keys
 
+
+    def test_bulk_introspection(self):
+        bulk_reader = MysqlReader(dict(self.options, bulk_introspection=True))
+        try:
+            tables = list(self.reader.tables)
+            bulk_tables = list(bulk_reader.tables)
+            self.assertEqual([t.name for t in tables], [t.name for t in bulk_tables])
+            for table, bulk_table in zip(tables, bulk_tables):
+                self.assertEqual(table.columns, bulk_table.columns)
+                self.assertEqual(table.comment, bulk_table.comment)
+                self.assertEqual(sorted(table.foreign_keys), sorted(bulk_table.foreign_keys))
+                self.assertEqual(sorted(table.indexes), sorted(bulk_table.indexes))
+                self.assertEqual(table.triggers, bulk_table.triggers)
+        finally:
+            bulk_reader.close()
+
+    def test_maxval(self):
+        for table in self.reader.tables:
+            for column in (c for c in table.columns if c['auto_increment']):
+                res = self.reader.db.query('SELECT MAX(`%s`) FROM `%s`' % (column['name'], table.name), one=True)
+                assert column['maxval'] >= (res[0] or 0)
+
+    def test_table_names(self):
+        self.assertEqual(self.reader.table_names, [t.name for t in self.reader.tables])
+
+    def test_snapshot(self):
+        conn = MySQLdb.connect(**self.args)
+        try:
+            with closing(conn.cursor()) as cur:
+                cur.execute('DROP TABLE IF EXISTS snapshot_test')
+                cur.execute('CREATE TABLE snapshot_test (id INT PRIMARY KEY) ENGINE=InnoDB')
+                cur.execute('INSERT INTO snapshot_test VALUES (1), (2)')
+                conn.commit()
+                self.reader.lock()
+                try:
+                    self.reader.snapshot()
+                finally:
+                    self.reader.unlock()
+                assert self.reader.lock_db is None
+                # changes committed by another connection since are not seen
+                cur.execute('INSERT INTO snapshot_test VALUES (3)')
+                cur.execute('DELETE FROM snapshot_test WHERE id = 1')
+                conn.commit()
+                table = MysqlReader.Table(self.reader, 'snapshot_test')
+                self.assertEqual(sorted(row[0] for row in self.reader.read(table)), [1, 2])
+                # ends the snapshot, which holds a metadata lock on the table
+                self.reader.db.conn.rollback()
+                self.assertEqual(sorted(row[0] for row in self.reader.read(table)), [2, 3])
+                self.reader.db.conn.rollback()
+                cur.execute('DROP TABLE snapshot_test')
+        finally:
+            conn.close()
+
+    def test_use_unicode(self):
+        bytes_reader = MysqlReader(dict(self.options, use_unicode=False))
+        try:
+            for table, bytes_table in zip(self.reader.tables, bytes_reader.tables):
+                for row, bytes_row in zip(self.reader.read(table), bytes_reader.read(bytes_table)):
+                    for value, bytes_value in zip(row, bytes_row):
+                        if isinstance(value, unicode):
+                            self.assertEqual(bytes_value, value.encode('utf8'))
+                        else:
+                            self.assertEqual(bytes_value, value)
+        finally:
+            bytes_reader.close()
+
+    def test_read_blocks(self):
+        for table in self.reader.tables:
+            blocks = list(self.reader.read_blocks(table, size=2))
+            assert all(0 < len(block) <= 2 for block in blocks)
+            self.assertEqual([row for block in blocks for row in block], list(self.reader.read(table)))
+
+    def test_session_variables(self):
+        reader = MysqlReader(dict(self.options, session_variables={'net_write_timeout': 600}))
+        try:
+            self.assertEqual(int(reader.db.query('SELECT @@SESSION.net_write_timeout', one=True)[0]), 600)
+        finally:
+            reader.close()
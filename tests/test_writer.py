@@ -1,17 +1,31 @@
 from __future__ import with_statement, absolute_import
+import gzip
+import json
 import os
 import sys
 import re
+import shutil
 import tempfile
+import threading
 import unittest
+from cStringIO import StringIO
+
+import psycopg2
 
 from . import WithReader
 
 sys.path.append(os.path.abspath('../'))
 
-from mysql2pgsql.lib.postgres_writer import PostgresWriter
+from mysql2pgsql.lib.mysql_reader import MysqlReader, Rows, split_values
+from mysql2pgsql.lib.postgres_writer import PostgresWriter, _escape, escape_column
 from mysql2pgsql.lib.postgres_file_writer import PostgresFileWriter
-from mysql2pgsql.lib.postgres_db_writer import PostgresDbWriter
+from mysql2pgsql.lib.postgres_db_writer import ConnectionPool, PostgresDbWriter
+from mysql2pgsql.lib.postgres_directory_writer import DATA_PREAMBLE, PostgresDirectoryWriter
+from mysql2pgsql.lib.checkpoint import Checkpoint
+from mysql2pgsql.lib.config import Config
+from mysql2pgsql.lib.index_builder import IndexBuilder
+from mysql2pgsql.lib.metrics import Metrics
+from mysql2pgsql.lib.restore import CopyData, Restorer
 
 def squeeze(val):
     return re.sub(r"[\x00-\x20]+", " ", val).strip()
@@ -67,6 +81,198 @@ class TestPostgresWriter(WithTables):
         constraint_cmds = self.writer.write_constraints(self.table2)
         assert constraint_cmds
 
+    def test_row_encoder(self):
+        encode = self.writer.row_encoder(self.table1)
+        for row in self.reader.read(self.table1):
+            processed = list(row)
+            self.writer.process_row(self.table1, processed)
+            line = encode(row)
+            assert line.endswith('\n')
+            self.assertEqual(line[:-1].split('\t'), processed)
+
+    def test_block_encoder(self):
+        rows = list(self.reader.read(self.table1))
+        batch_writer = PostgresWriter(index_prefix='', batch_size=2)
+        self.assertEqual(list(batch_writer.encode_rows(self.table1, rows)),
+                         list(self.writer.encode_rows(self.table1, rows)))
+
+    def test_encode_rows_metrics(self):
+        rows = list(self.reader.read(self.table1))
+        metrics = self.writer.metrics = Metrics()
+        with metrics.phase(self.table1.name, 'data'):
+            lines = list(self.writer.encode_rows(self.table1, rows))
+        self.writer.metrics = None
+        self.assertEqual(lines, list(self.writer.encode_rows(self.table1, rows)))
+        self.assertEqual(metrics.pop_records()[0]['rows'], len(rows))
+
+
+class TestEscape(unittest.TestCase):
+    values = ['plain', u'caf\xe9', 'a\tb\nc\\d\re\0f', u'\xe9\t' * 100, '', 'x' * 200]
+    escaped = ['plain', u'caf\xe9', 'a\\tb\\nc\\\\d\\ref', u'\xe9\\t' * 100, '', 'x' * 200]
+
+    def test_escape(self):
+        self.assertEqual([_escape(v) for v in self.values], self.escaped)
+
+    def test_escape_column(self):
+        self.assertEqual(escape_column(self.values), self.escaped)
+        self.assertEqual(escape_column(['clean', u'caf\xe9']), ['clean', u'caf\xe9'])
+        self.assertEqual(escape_column(['caf\xc3\xa9', u'\xe9\n']), ['caf\xc3\xa9', u'\xe9\\n'])
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        config = Config(os.path.join(os.path.dirname(__file__), 'mysql2pgsql-test.yml'), False)
+        self.writer = PostgresDbWriter(config.options['destination']['postgres'], index_prefix='')
+        self.checkpoint = Checkpoint(self.writer)
+        self.checkpoint.clear()
+        self.checkpoint.setup()
+
+    def tearDown(self):
+        self.checkpoint.clear()
+        self.writer.close()
+
+    def test_record_plan_interrupted(self):
+        ranges = [(None, 10), (10, 20), (20, None)]
+        record = self.checkpoint.record
+
+        def crash(table_name, phase, key_range=None, cursor=None):
+            if key_range == (20, None):
+                raise KeyboardInterrupt
+            record(table_name, phase, key_range, cursor)
+        self.checkpoint.record = crash
+        self.assertRaises(KeyboardInterrupt, self.checkpoint.record_plan, 'events', ranges)
+
+        # nothing of the plan was kept, so the resumed run splits the whole table again
+        resumed = Checkpoint(self.writer)
+        resumed.setup()
+        self.assertEqual(resumed.plan('events'), None)
+        resumed.record_plan('events', ranges)
+        resumed = Checkpoint(self.writer)
+        resumed.setup()
+        self.assertEqual(resumed.pending('events', resumed.plan('events')), ranges)
+
+
+def events_table():
+    table = MysqlReader.Table(None, 'events')
+    table._columns = [
+        {'name': 'id', 'table_name': table.name, 'type': 'integer', 'length': None, 'decimals': None,
+         'null': False, 'primary_key': True, 'auto_increment': False, 'default': None, 'comment': ''},
+        {'name': 'created', 'table_name': table.name, 'type': 'datetime', 'length': None, 'decimals': None,
+         'null': True, 'primary_key': False, 'auto_increment': False, 'default': None, 'comment': ''},
+        ]
+    table._status = {'rows': 0, 'comment': '', 'auto_increment': None}
+    table._indexes = [{'name': 'created', 'columns': ['created'], 'unique': False}]
+    table._foreign_keys, table._triggers, table._partitioning = [], [], {}
+    return table
+
+
+class TestCopyRows(unittest.TestCase):
+    def test_pipeline_stopped_on_error(self):
+        config = Config(os.path.join(os.path.dirname(__file__), 'mysql2pgsql-test.yml'), False)
+        writer = PostgresDbWriter(config.options['destination']['postgres'], index_prefix='', pipeline=True)
+        closed = []
+
+        def blocks():
+            try:
+                for i in xrange(10 ** 9):
+                    yield [(i, None)] * 1000
+            finally:
+                closed.append(True)
+
+        def copy_from(f, table_name, columns, before_commit=None):
+            f.read()
+            raise psycopg2.DataError('copy failed')
+        writer.copy_from = copy_from
+        threads = threading.active_count()
+        try:
+            writer.copy_rows(events_table(), Rows(blocks()), '"events"')
+        except psycopg2.DataError:
+            # while the error is handled, its traceback keeps the rows and threads of the copy referenced
+            self.assertEqual(threading.active_count(), threads)
+            self.assertEqual(closed, [True])
+        else:
+            self.fail('the copy did not fail')
+        finally:
+            writer.close()
+
+
+class TestPartitions(unittest.TestCase):
+    def table(self, method, columns, partitions, function=None):
+        table = events_table()
+        table._partitioning = {'method': method, 'function': function, 'columns': columns, 'partitions': [
+            {'name': name, 'values': values and split_values(values), 'rows': 0} for name, values in partitions]}
+        return table
+
+    def setUp(self):
+        self.writer = PostgresWriter('')
+
+    def test_split_values(self):
+        self.assertEqual(split_values("MAXVALUE"), ['MAXVALUE'])
+        self.assertEqual(split_values("'a,b', 'it''s',NULL"), ["'a,b'", "'it''s'", 'NULL'])
+        self.assertEqual(split_values("(1,'a'),(2,'b')"), ["(1,'a')", "(2,'b')"])
+
+    def test_range(self):
+        table = self.table('RANGE', ['created'], [('p2020', '2021'), ('pmax', 'MAXVALUE')], function='year')
+        self.assertEqual(self.writer.partition_statements(table), ('RANGE ("created")', [
+            ('events_p2020', "FOR VALUES FROM (MINVALUE) TO ('2021-01-01')"),
+            ('events_pmax', "FOR VALUES FROM ('2021-01-01') TO (MAXVALUE)"),
+            ('events_default', 'DEFAULT')]))
+        table = self.table('RANGE', ['created'], [('p0', '737790')], function='to_days')
+        self.assertEqual(self.writer.partition_statements(table)[1][0][1], "FOR VALUES FROM (MINVALUE) TO ('2020-01-01')")
+        self.assertEqual(self.writer.set_logged(table), ['ALTER TABLE "events_p0" SET LOGGED;',
+                                                         'ALTER TABLE "events_default" SET LOGGED;'])
+
+    def test_list_and_hash(self):
+        table = self.table('LIST', ['id'], [('odd', '1,3'), ('even', '2,4')])
+        self.assertEqual(self.writer.partition_statements(table), ('LIST ("id")', [
+            ('events_odd', 'FOR VALUES IN (1, 3)'), ('events_even', 'FOR VALUES IN (2, 4)')]))
+        table = self.table('KEY', ['id'], [('p0', None), ('p1', None)])
+        self.assertEqual(self.writer.partition_statements(table), ('HASH ("id")', [
+            ('events_p0', 'FOR VALUES WITH (MODULUS 2, REMAINDER 0)'),
+            ('events_p1', 'FOR VALUES WITH (MODULUS 2, REMAINDER 1)')]))
+
+    def test_write_table(self):
+        config = Config(os.path.join(os.path.dirname(__file__), 'mysql2pgsql-test.yml'), False)
+        writer = PostgresDbWriter(dict(config.options['destination']['postgres'], load_strategy='unlogged'),
+                                  index_prefix='')
+        table = self.table('RANGE', ['created'], [('p2020', '2021'), ('pmax', 'MAXVALUE')], function='year')
+        try:
+            writer.write_table(table)
+            writer.write_indexes(table)
+            writer.execute(["INSERT INTO events VALUES (1, '2020-06-01'), (2, '2021-06-01'), (3, NULL);"])
+            cur = writer.conn.cursor()
+            cur.execute('SELECT tableoid::regclass::text, COUNT(*) FROM events GROUP BY 1 ORDER BY 1')
+            self.assertEqual(cur.fetchall(), [('events_default', 1), ('events_p2020', 1), ('events_pmax', 1)])
+            writer.set_logged(table)
+            cur.execute("SELECT DISTINCT relpersistence FROM pg_class WHERE relname LIKE 'events%'")
+            self.assertEqual(cur.fetchall(), [('p', )])
+        finally:
+            writer.conn.rollback()
+            writer.execute('DROP TABLE IF EXISTS events CASCADE;')
+            writer.close()
+
+    def test_unsupported(self):
+        for table in (self.table('RANGE', ['created'], [('p0', '0')], function='unix_timestamp'),
+                      self.table('HASH', [], [('p0', None)], function='`id` % 4'),
+                      self.table('LIST', ['id', 'created'], [('p0', "(1,'a')")])):
+            self.assertEqual(self.writer.partition_statements(table), (None, []))
+            self.assertEqual(self.writer.set_logged(table), ['ALTER TABLE "events" SET LOGGED;'])
+
+
+class TestCopyData(unittest.TestCase):
+    rows = '1\tcaf\xc3\xa9\n2\t\\N\n'
+
+    def read(self, data, size):
+        copy_data = CopyData(StringIO(data))
+        return ''.join(iter(lambda: copy_data.read(size), ''))
+
+    def test_read(self):
+        copy = 'COPY "t" ("id", "name") FROM stdin;\n'
+        for size in (1, 5, 1024):
+            self.assertEqual(self.read(DATA_PREAMBLE + copy + self.rows + '\\.\n', size), self.rows)
+            # dumps written before the preamble
+            self.assertEqual(self.read(copy + self.rows + '\\.\n', size), self.rows)
+
 
 class WithOutput(WithTables):
 
@@ -104,6 +310,53 @@ class TestPostgresFileWriter(WithOutput):
         self.writer.write_contents(self.table1, self.reader)
 
 
+class TestPostgresDirectoryWriter(WithOutput):
+    def setUp(self):
+        super(self.__class__, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.writer = PostgresDirectoryWriter(self.path, index_prefix='')
+
+    def tearDown(self):
+        super(self.__class__, self).tearDown()
+        shutil.rmtree(self.path)
+
+    def test_write_table_contents_and_indexes(self):
+        self.writer.write_table(self.table1)
+        entry = self.writer.write_contents(self.table1, self.reader)
+        self.writer.write_indexes(self.table1)
+        self.writer.write_constraints(self.table2)
+        self.writer.close()
+
+        with open(os.path.join(self.path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest['compression'], 'gzip')
+        tables = dict((t['name'], t) for t in manifest['tables'])
+        self.assertEqual(tables[self.table1.name]['data'], [entry])
+        self.assertTrue(tables[self.table1.name]['primary_key'] or tables[self.table1.name]['indexes'])
+        with gzip.open(os.path.join(self.path, entry['file'])) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], "SET client_encoding = 'UTF8';")
+        self.assertEqual(lines[1], entry['copy'])
+        self.assertEqual(lines[-1], '\\.')
+        self.assertEqual(len(lines) - 3, len(list(self.reader.read(self.table1))))
+
+    def test_restore(self):
+        self.writer.write_table(self.table1)
+        self.writer.write_contents(self.table1, self.reader)
+        self.writer.write_indexes(self.table1)
+        self.writer.close()
+
+        options = self.config.options['destination']['postgres']
+        open_writer = lambda: PostgresDbWriter(options, index_prefix='')
+        Restorer(self.path, open_writer, workers=2, index_workers=2).restore()
+        writer = open_writer()
+        try:
+            count = writer.query('SELECT COUNT(*) FROM "%s"' % self.table1.name, one=True)[0]
+        finally:
+            writer.close()
+        self.assertEqual(count, len(list(self.reader.read(self.table1))))
+
+
 class TestPostgresDbWriter(WithOutput):
     def setUp(self):
         super(self.__class__, self).setUp()
@@ -122,3 +375,79 @@ class TestPostgresDbWriter(WithOutput):
 
     def test_write_contents(self):
         self.writer.write_contents(self.table1, self.reader)
+
+    def test_file_obj_faker_read(self):
+        encoder = self.writer.row_encoder(self.table1)
+        lines = [encoder(row) for row in self.reader.read(self.table1)]
+        f = PostgresDbWriter.FileObjFaker(self.table1, self.reader.read(self.table1), encoder)
+        blocks = list(iter(lambda: f.read(64), ''))
+        self.assertEqual(''.join(blocks), ''.join(lines))
+        assert len(blocks) <= len(lines)
+
+    def test_write_contents_binary(self):
+        self.writer.write_table(self.table1)
+        self.writer.copy_format = 'binary'
+        self.writer.write_contents(self.table1, self.reader)
+
+    def test_write_contents_checkpoint(self):
+        self.writer.write_table(self.table1)
+        checkpoint = self.writer.checkpoint = Checkpoint(self.writer)
+        checkpoint.setup()
+        self.writer.write_contents(self.table1, self.reader)
+        self.assertEqual(checkpoint.pending(self.table1.name, [None]), [])
+        resumed = Checkpoint(self.writer)
+        resumed.setup()
+        assert resumed.started(self.table1.name)
+        checkpoint.clear()
+
+    def test_index_builder(self):
+        options = self.config.options['destination']['postgres']
+        self.writer.write_table(self.table1)
+        builder = IndexBuilder(lambda: PostgresDbWriter(options, index_prefix=''), 2)
+        tasks = builder.tasks(self.writer, [self.table1], [self.table1])
+        self.assertEqual(sum(len(t.statements) for t in tasks if t.phase == 'indexes'),
+                         len(PostgresWriter(index_prefix='').write_indexes(self.table1)))
+        builder.build([self.table1], [self.table1])
+
+    def test_connection_pool(self):
+        options = self.config.options['destination']['postgres']
+        pool = ConnectionPool(options, size=1)
+        writer = PostgresDbWriter(options, index_prefix='', pool=pool)
+        conn = writer.conn
+        writer.close()
+        assert not conn.closed
+        writer = PostgresDbWriter(options, index_prefix='', pool=pool)
+        self.assertIs(writer.conn, conn)
+        writer.close()
+        pool.closeall()
+        assert conn.closed
+
+    def test_execute_statements(self):
+        self.writer.write_table(self.table1)
+        self.assertRaises(psycopg2.ProgrammingError, self.writer.execute,
+                          ['CREATE INDEX "idx_ok" ON "%s" ("id");' % self.table1.name, 'CREATE INDEX "idx_bad" ON "nope" ("id");'])
+        count = self.writer.query("SELECT COUNT(*) FROM pg_indexes WHERE indexname = 'idx_ok'", one=True)[0]
+        self.assertEqual(count, 0)
+
+    def test_load_strategy_unlogged(self):
+        options = dict(self.config.options['destination']['postgres'], load_strategy='unlogged')
+        writer = PostgresDbWriter(options, index_prefix='')
+        try:
+            persistence = 'SELECT relpersistence FROM pg_class WHERE relname = %s'
+            writer.write_table(self.table1)
+            writer.write_contents(self.table1, self.reader)
+            self.assertEqual(writer.query(persistence, (self.table1.name, ), one=True)[0], 'u')
+            writer.write_indexes(self.table1)
+            writer.set_logged(self.table1)
+            self.assertEqual(writer.query(persistence, (self.table1.name, ), one=True)[0], 'p')
+        finally:
+            writer.close()
+        self.assertRaises(ValueError, PostgresDbWriter, dict(options, load_strategy='nope'), index_prefix='')
+
+    def test_sync_contents(self):
+        self.writer.write_table(self.table1)
+        self.writer.write_contents(self.table1, self.reader)
+        self.writer.write_indexes(self.table1)
+        self.writer.sync_contents(self.table1, self.reader)
+        count = self.writer.query('SELECT COUNT(*) FROM "%s"' % self.table1.name, one=True)[0]
+        self.assertEqual(count, len(list(self.reader.read(self.table1))))